@@ -1,16 +1,43 @@
-from sqlalchemy import create_engine, Column, Integer, Text, Float, Boolean, exc, text, DateTime, VARCHAR
+from sqlalchemy import create_engine, Column, Integer, Text, Float, Boolean, exc, text, DateTime, VARCHAR, func, update, insert, tuple_, event, Index, inspect, or_, bindparam
 from sqlalchemy.orm import declarative_base, sessionmaker
 from sqlalchemy.exc import SQLAlchemyError
-from datetime import datetime
-import json, os
+from sqlalchemy.pool import QueuePool
+from PyQt5.QtCore import QThread, pyqtSignal
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import psycopg2, psycopg2.extensions
+import asyncio, bisect, contextvars, functools, itertools
+import json, os, select, threading, time
 
 class DatabaseConfig:
-    def __init__(self, host="localhost", database="avt", user="postgres", password="123456", port=5432):
+    def __init__(self, host="localhost", database="avt", user="postgres", password="123456", port=5432, use_notify=False,
+                 pool_size=5, max_overflow=10, pool_recycle=1800, pool_pre_ping=True, pool_timeout=30, ensure_indexes=False,
+                 archive_after_days=None, query_stats_interval=None, query_stats_file=None):
         self.host = host
         self.database = database
         self.user = user
         self.password = password
         self.port = port
+        self.use_notify = use_notify # push task changes by LISTEN/NOTIFY instead of polling
+        # connection pool
+        self.pool_size = pool_size # connections kept open
+        self.max_overflow = max_overflow # extra connections opened under load
+        self.pool_recycle = pool_recycle # in seconds, reconnect connections older than this (before server/proxy idle timeout)
+        self.pool_pre_ping = pool_pre_ping # test connection on checkout, replace dead ones after DB failover
+        self.pool_timeout = pool_timeout # in seconds, max wait for a free connection
+        self.ensure_indexes = ensure_indexes # create missing indexes of hot avt_task queries at start
+        self.archive_after_days = archive_after_days # move finished/error tasks older than this to avt_task_archive, None: disabled
+        self.query_stats_interval = query_stats_interval # in seconds, dump query stats periodically, None: disabled
+        self.query_stats_file = query_stats_file # append dumps as json lines to this file, None: print them
+    
+    def get_pool_options(self):
+        return {
+            'pool_size': self.pool_size,
+            'max_overflow': self.max_overflow,
+            'pool_recycle': self.pool_recycle,
+            'pool_pre_ping': self.pool_pre_ping,
+            'pool_timeout': self.pool_timeout
+        }
         
     def save_to_json(self, file_path='config.json'):
         if not os.path.exists(file_path):
@@ -24,7 +51,13 @@ class DatabaseConfig:
             'database': self.database,
             'user': self.user,
             'password': self.password,
-            'port': self.port
+            'port': self.port,
+            'use_notify': self.use_notify,
+            **self.get_pool_options(),
+            'ensure_indexes': self.ensure_indexes,
+            'archive_after_days': self.archive_after_days,
+            'query_stats_interval': self.query_stats_interval,
+            'query_stats_file': self.query_stats_file
         }
         
         with open(file_path, 'w') as json_file:
@@ -62,6 +95,74 @@ class AvtTask(Base):
     task_message = Column(VARCHAR, nullable=True)
     created_at = Column(DateTime, nullable=False)
     updated_at = Column(DateTime, nullable=True)
+    
+    # indexes of hot queries, created CONCURRENTLY by Database.ensure_indexes (no write lock on the live table)
+    __table_args__ = (
+        # task list, keyset pagination
+        Index('ix_avt_task_created_at_id', created_at, id, postgresql_concurrently=True),
+        # waiting queue (task_stat < 0): claim_next_task
+        Index('ix_avt_task_waiting', task_stat, created_at, postgresql_where=text('task_stat < 0'), postgresql_concurrently=True),
+        # running tasks (task_stat > 1) by worker
+        Index('ix_avt_task_running_worker_ip', worker_ip, postgresql_where=text('task_stat > 1'), postgresql_concurrently=True),
+    )
+
+# hot queries checked by Database.check_query_plans, they should not scan the whole avt_task
+HOT_TASK_QUERIES = {
+    'task list': "SELECT id FROM avt_task ORDER BY created_at DESC, id DESC LIMIT 100",
+    'claim waiting task': "SELECT id FROM avt_task WHERE task_stat < 0 ORDER BY task_stat DESC, created_at, id LIMIT 1",
+    'running tasks of worker': "SELECT id FROM avt_task WHERE task_stat > 1 AND worker_ip = '127.0.0.1'",
+    'change feed': "SELECT id FROM avt_task WHERE id > (SELECT max(id) FROM avt_task) - 200",
+}
+# sequential scan on a table smaller than this is normal (cheaper than index scan)
+SEQ_SCAN_WARNING_MIN_ROWS = 10000
+
+class AvtTaskArchive(Base):
+    # finished/error tasks moved out of avt_task by Database.archive_finished_tasks, keep the same id
+    __tablename__ = 'avt_task_archive'
+    
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    user_id = Column(Integer, nullable=True)
+    task_type = Column(Integer, nullable=False)
+    task_config_id = Column(Integer, nullable=True)
+    creator = Column(VARCHAR, nullable=True)
+    task_param = Column(Text, nullable=True)
+    task_stat = Column(Integer, nullable=True)
+    worker_ip = Column(VARCHAR, nullable=True)
+    process_id = Column(Integer, nullable=True)
+    task_eta = Column(Integer, nullable=True)
+    task_output = Column(Text, nullable=True)
+    task_message = Column(VARCHAR, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=True)
+    archived_at = Column(DateTime, nullable=False)
+
+# move one batch of old terminal tasks, skip rows locked by others (being updated), one transaction per batch
+TASK_COLUMN_NAMES = ', '.join(column.name for column in AvtTask.__table__.columns)
+ARCHIVE_TASKS_SQL = f"""
+WITH moved AS (
+    DELETE FROM avt_task WHERE id IN (
+        SELECT id FROM avt_task
+        WHERE task_stat IN (0, 1) AND coalesce(updated_at, created_at) < :cutoff
+        ORDER BY id LIMIT :batch_size
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING {TASK_COLUMN_NAMES}
+)
+INSERT INTO avt_task_archive ({TASK_COLUMN_NAMES}, archived_at)
+SELECT {TASK_COLUMN_NAMES}, localtimestamp FROM moved
+"""
+
+class TaskRow:
+    # Light read-only view of an avt_task row for task list: every column except big task_param and task_output
+    # use Database.get_task_by_id to get the full task
+    __slots__ = ('id', 'user_id', 'task_type', 'task_config_id', 'creator', 'task_stat', 'worker_ip', 'process_id',
+                 'task_eta', 'task_message', 'created_at', 'updated_at')
+    
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+TASK_ROW_COLUMNS = [getattr(AvtTask, name) for name in TaskRow.__slots__]
 
 class TaskConfig(Base):
     __tablename__ = 'avt_task_config'
@@ -80,12 +181,392 @@ class TaskConfig(Base):
     updated_at = Column(DateTime, nullable=True)
     parent_type = Column(Integer, nullable=True)
 
+# LISTEN/NOTIFY channel for avt_task changes, payload: {"id": task id, "op": INSERT/UPDATE/DELETE, "task_stat": stat}
+TASK_NOTIFY_CHANNEL = 'avt_task_changed'
+
+TASK_NOTIFY_TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION avt_task_notify() RETURNS trigger AS $$
+DECLARE
+    task_row avt_task%ROWTYPE;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        task_row := OLD;
+    ELSE
+        task_row := NEW;
+    END IF;
+    PERFORM pg_notify('avt_task_changed', CAST(json_build_object('id', task_row.id, 'op', TG_OP, 'task_stat', task_row.task_stat) AS text));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'avt_task_notify_trigger') THEN
+        CREATE TRIGGER avt_task_notify_trigger AFTER INSERT OR UPDATE OR DELETE ON avt_task
+            FOR EACH ROW EXECUTE PROCEDURE avt_task_notify();
+    END IF;
+END
+$$;
+"""
+
+# LISTEN/NOTIFY channel for avt_task_config changes, payload: operation
+TASK_CONFIG_NOTIFY_CHANNEL = 'avt_task_config_changed'
+
+TASK_CONFIG_NOTIFY_TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION avt_task_config_notify() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('avt_task_config_changed', TG_OP);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'avt_task_config_notify_trigger') THEN
+        CREATE TRIGGER avt_task_config_notify_trigger AFTER INSERT OR UPDATE OR DELETE ON avt_task_config
+            FOR EACH STATEMENT EXECUTE PROCEDURE avt_task_config_notify();
+    END IF;
+END
+$$;
+"""
+
+class TaskNotificationListener(QThread):
+    # Listen avt_task and avt_task_config notifications on a dedicated connection and forward them as Qt signals
+    signal_task_notified = pyqtSignal(int, str) # task id, operation (INSERT/UPDATE/DELETE)
+    signal_task_config_changed = pyqtSignal()
+    signal_listener_failed = pyqtSignal(str) # error message, listener stopped, caller should fall back to polling
+    
+    def __init__(self, db_url, channel=TASK_NOTIFY_CHANNEL, config_channel=TASK_CONFIG_NOTIFY_CHANNEL, poll_timeout=1.0):
+        super().__init__()
+        self.db_url = db_url
+        self.channel = channel
+        self.config_channel = config_channel
+        self.poll_timeout = poll_timeout # in seconds, max time to notice stop() request
+        self.running = False
+    
+    def run(self):
+        self.running = True
+        try:
+            connection = psycopg2.connect(self.db_url)
+            connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {self.channel};")
+                cursor.execute(f"LISTEN {self.config_channel};")
+        except psycopg2.Error as e:
+            print(f"Error starting task notification listener: {e}")
+            self.signal_listener_failed.emit(str(e))
+            return
+        
+        print(f"Listening task notifications on channels: {self.channel}, {self.config_channel}")
+        try:
+            while self.running:
+                if select.select([connection], [], [], self.poll_timeout) == ([], [], []):
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    notify = connection.notifies.pop(0)
+                    if notify.channel == self.config_channel:
+                        self.signal_task_config_changed.emit()
+                        continue
+                    try:
+                        payload = json.loads(notify.payload)
+                        self.signal_task_notified.emit(int(payload['id']), payload.get('op', ''))
+                    except (ValueError, KeyError, TypeError):
+                        print(f"Invalid task notification payload: {notify.payload}")
+        except (psycopg2.Error, OSError) as e:
+            print(f"Task notification listener stopped: {e}")
+            if self.running:
+                self.signal_listener_failed.emit(str(e))
+        finally:
+            connection.close()
+    
+    def stop(self):
+        self.running = False
+        self.wait()
+
+# task_stat of finished and error (also killed) task
+TERMINAL_TASK_STATS = (0, 1)
+# get_changes_since re-reads this many ids below its watermark: ids are taken from the sequence at insert
+# but a row is only visible once its transaction commits, so a smaller id can be committed after a bigger one
+CHANGE_FEED_ID_WINDOW = 200
+
+class PoolStats:
+    # Counters of the connection pool, updated by engine events and TimedQueuePool
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connects = 0 # new connections opened
+        self.checkouts = 0
+        self.invalidations = 0 # connections found dead/invalidated (ex: after DB failover)
+        self.timeouts = 0 # checkouts failed by pool_timeout
+        self.total_wait_time = 0 # in seconds, time waiting for a connection from the pool
+        self.max_wait_time = 0
+        self.connecting = threading.local() # time opening new connections in the current checkout of each thread
+    
+    def start_checkout(self):
+        self.connecting.start_time = None
+        self.connecting.total_time = 0
+    
+    def start_connect(self, *args):
+        # engine do_connect event, before the DBAPI connection is opened
+        self.connecting.start_time = time.perf_counter()
+    
+    def end_connect(self, *args):
+        # engine connect event, after a new DBAPI connection is opened
+        start_time = getattr(self.connecting, 'start_time', None)
+        if start_time is not None:
+            self.connecting.total_time = getattr(self.connecting, 'total_time', 0) + time.perf_counter() - start_time
+            self.connecting.start_time = None
+        self.increase('connects')
+    
+    def get_connect_time(self):
+        return getattr(self.connecting, 'total_time', 0)
+    
+    def record_wait(self, wait_time, timeout=False):
+        with self.lock:
+            if timeout:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+    
+    def increase(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+# logical Database operation (method name) of the queries run in the current thread/task
+current_db_operation = contextvars.ContextVar('current_db_operation', default=None)
+
+# upper bounds (in ms) of the query latency histogram buckets, last bucket is everything slower
+QUERY_LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+def db_operation(method):
+    # name the queries run by a Database method after it, nested calls keep the outer operation
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if current_db_operation.get() is not None:
+            return method(*args, **kwargs)
+        token = current_db_operation.set(method.__name__)
+        try:
+            return method(*args, **kwargs)
+        finally:
+            current_db_operation.reset(token)
+    return wrapper
+
+class OperationStats:
+    # Query counters of one logical operation
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_time = 0 # in seconds
+        self.max_time = 0
+        self.histogram = [0] * (len(QUERY_LATENCY_BUCKETS_MS) + 1)
+    
+    def percentile(self, percent):
+        # upper bound (ms) of the bucket holding the percentile, None if it is in the last (unbounded) bucket or there is no sample
+        if not self.count:
+            return None
+        rank = self.count * percent / 100
+        seen = 0
+        for bound, bucket_count in zip(QUERY_LATENCY_BUCKETS_MS, self.histogram):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+        return None
+    
+    def to_dict(self):
+        stats = {
+            'count': self.count,
+            'errors': self.errors,
+            'rows': self.rows,
+            'avg_ms': self.total_time / self.count * 1000 if self.count else 0,
+            'max_ms': self.max_time * 1000
+        }
+        if self.count: # no percentile without sample (ex: operation with only errors)
+            stats.update({
+                'p50_ms': self.percentile(50),
+                'p95_ms': self.percentile(95),
+                'p99_ms': self.percentile(99)
+            })
+        stats['histogram'] = self.get_histogram()
+        return stats
+    
+    def get_histogram(self):
+        histogram = {f"<={bound}ms": bucket_count for bound, bucket_count in zip(QUERY_LATENCY_BUCKETS_MS, self.histogram)}
+        histogram[f">{QUERY_LATENCY_BUCKETS_MS[-1]}ms"] = self.histogram[-1]
+        return histogram
+
+class QueryStats:
+    # Per operation query stats, updated by engine cursor events
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.operations = {} # {operation: OperationStats}
+    
+    def get_operation(self):
+        operation = current_db_operation.get() or 'other'
+        stats = self.operations.get(operation)
+        if stats is None:
+            stats = self.operations.setdefault(operation, OperationStats())
+        return stats
+    
+    def record_query(self, query_time, rows):
+        with self.lock:
+            stats = self.get_operation()
+            stats.count += 1
+            stats.rows += max(rows, 0) # rowcount is -1 when unknown
+            stats.total_time += query_time
+            stats.max_time = max(stats.max_time, query_time)
+            stats.histogram[bisect.bisect_left(QUERY_LATENCY_BUCKETS_MS, query_time * 1000)] += 1
+    
+    def record_error(self):
+        with self.lock:
+            self.get_operation().errors += 1
+    
+    def snapshot(self, reset=False):
+        with self.lock:
+            operations = {operation: stats.to_dict() for operation, stats in sorted(self.operations.items())}
+            if reset:
+                self.operations = {}
+        return operations
+    
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+    
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        start_time = conn.info['query_start_time'].pop()
+        self.record_query(time.perf_counter() - start_time, cursor.rowcount)
+    
+    def handle_error(self, exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get('query_start_time'):
+            connection.info['query_start_time'].pop()
+        self.record_error()
+
+class TimedQueuePool(QueuePool):
+    # QueuePool that measures time waiting for a connection
+    # time opening a new connection is not waiting, it is measured by the engine do_connect/connect events and left out
+    stats = None
+    
+    def connect(self):
+        if self.stats is None:
+            return super().connect()
+        self.stats.start_checkout()
+        start_time = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.stats.record_wait(time.perf_counter() - start_time - self.stats.get_connect_time(), timeout=True)
+            raise
+        self.stats.record_wait(time.perf_counter() - start_time - self.stats.get_connect_time())
+        return connection
+    
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+class TaskWriteBuffer:
+    # Write-behind buffer for task updates, flushed by a background thread
+    # - updates of the same task are merged, later values win
+    # - all pending updates are written in one transaction every flush_interval ms or when max_pending tasks are waiting
+    # - terminal updates (finished/error) are written immediately with the pending values of that task,
+    #   after any flush in progress, so they are never reordered with older updates
+    # - updates of a failed write are put back in the buffer (newer values queued meanwhile win) and written by next flush
+    def __init__(self, db, flush_interval=200, max_pending=100):
+        self.db = db
+        self.flush_interval = flush_interval # in ms
+        self.max_pending = max_pending
+        self.pending = {} # {task_id: {column: value}}
+        self.pending_lock = threading.Lock()
+        self.flush_lock = threading.Lock() # one flush at a time, keep write order
+        self.wakeup = threading.Event()
+        self.running = False
+        self.thread = None
+    
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="TaskWriteBuffer", daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+    
+    def run(self):
+        while self.running:
+            self.wakeup.wait(self.flush_interval / 1000)
+            self.wakeup.clear()
+            self.flush()
+    
+    def queue_update(self, task_id, **kwargs):
+        if kwargs.get('task_stat') in TERMINAL_TASK_STATS:
+            # take pending values after the flush in progress, they include values put back by a failed flush
+            with self.flush_lock:
+                with self.pending_lock:
+                    values = {**self.pending.pop(task_id, {}), **kwargs}
+                if self.db.update_task(task_id, **values):
+                    return True
+                self.requeue({task_id: values})
+                return False
+        
+        with self.pending_lock:
+            self.pending.setdefault(task_id, {}).update(kwargs)
+            full = len(self.pending) >= self.max_pending
+        if full:
+            self.wakeup.set()
+        return True
+    
+    def requeue(self, values_by_task_id):
+        with self.pending_lock:
+            for task_id, values in values_by_task_id.items():
+                self.pending[task_id] = {**values, **self.pending.get(task_id, {})}
+    
+    def flush(self):
+        with self.flush_lock:
+            with self.pending_lock:
+                pending, self.pending = self.pending, {}
+            if not pending:
+                return True
+            if self.db.update_tasks_values(pending):
+                return True
+            self.requeue(pending)
+            return False
+
 class Database:
-    def __init__(self, host, port, user, password, db_name):
+    def __init__(self, host, port, user, password, db_name, pool_size=5, max_overflow=10, pool_recycle=1800, pool_pre_ping=True, pool_timeout=30):
         print(f"Connecting to the database: {host}:{port}")
         self.db_url = self.create_db_url(host, port, user, password, db_name)
-        self.engine = create_engine(self.db_url)
+        self.engine = create_engine(self.db_url, poolclass=TimedQueuePool, pool_size=pool_size, max_overflow=max_overflow,
+                                    pool_recycle=pool_recycle, pool_pre_ping=pool_pre_ping, pool_timeout=pool_timeout)
+        self.pool_stats = PoolStats()
+        self.engine.pool.stats = self.pool_stats
+        event.listen(self.engine, 'do_connect', self.pool_stats.start_connect)
+        event.listen(self.engine, 'connect', self.pool_stats.end_connect)
+        event.listen(self.engine, 'invalidate', lambda *args: self.pool_stats.increase('invalidations'))
+        event.listen(self.engine, 'soft_invalidate', lambda *args: self.pool_stats.increase('invalidations'))
+        self.query_stats = QueryStats()
+        event.listen(self.engine, 'before_cursor_execute', self.query_stats.before_cursor_execute)
+        event.listen(self.engine, 'after_cursor_execute', self.query_stats.after_cursor_execute)
+        event.listen(self.engine, 'handle_error', self.query_stats.handle_error)
+        self.query_stats_thread = None
+        self.query_stats_stop = threading.Event()
         self.Session = sessionmaker(bind=self.engine)
+        self.write_buffer = None
+        # archive table can be created later (archive_finished_tasks on any node): only True is kept, False is checked again after a ttl
+        self.archive_table_exists = None
+        self.archive_table_checked_at = None
+        self.archive_table_ttl = 60 # in seconds
+        # task configs almost never change, cached by type and reloaded when (max(updated_at), count) changes
+        self.task_config_cache = {} # {task_type: [TaskConfig]}
+        self.task_config_cache_version = None
+        self.task_config_cache_checked_at = None
+        self.task_config_cache_ttl = 10 # in seconds, max time between two version checks
+        self.task_config_cache_lock = threading.Lock()
         self.connected = False
         try:
             self.test_connection()
@@ -98,12 +579,13 @@ class Database:
     def create_db_url(host, port, user, password, db_name):
         return f'postgresql://{user}:{password}@{host}:{port}/{db_name}'
 
+    @db_operation
     def add_task(self, task_type, creator, task_param=None, task_stat=None, worker_ip=None, process_id=None, 
                  task_eta=None, task_output=None, task_message=None, user_id=None, task_config_id=None):
         session = self.Session()
         
         try:
-            param_json = json.dumps(task_param) if (isinstance(task_param, list) or isinstance(task_param, dict)) else task_param
+            param_json = self.encode_json_param(task_param)
             
             new_task = AvtTask(
                 created_at=datetime.now(),
@@ -132,31 +614,152 @@ class Database:
         
         return task_id
 
+    @staticmethod
+    def encode_json_param(value):
+        return json.dumps(value) if (isinstance(value, list) or isinstance(value, dict)) else value
+
+    @db_operation
+    def add_tasks_bulk(self, tasks, batch_size=1000):
+        # enqueue many tasks in one transaction, tasks: iterable of dict with the same arguments as add_task
+        # rows are sent by batches of multi-row INSERT ... RETURNING id (executemany "insertmanyvalues")
+        # return list of new task ids in the same order as tasks, empty list if failed
+        session = self.Session()
+        task_ids = []
+        
+        try:
+            tasks = iter(tasks)
+            while True:
+                batch = list(itertools.islice(tasks, batch_size))
+                if not batch:
+                    break
+                
+                now = datetime.now()
+                rows = [{
+                    'created_at': now,
+                    'updated_at': now,
+                    'task_type': task['task_type'],
+                    'creator': task['creator'],
+                    'task_param': self.encode_json_param(task.get('task_param')),
+                    'task_stat': task.get('task_stat'),
+                    'worker_ip': task.get('worker_ip'),
+                    'process_id': task.get('process_id'),
+                    'task_eta': task.get('task_eta'),
+                    'task_output': task.get('task_output'),
+                    'task_message': task.get('task_message'),
+                    'user_id': task.get('user_id'),
+                    'task_config_id': task.get('task_config_id')
+                } for task in batch]
+                result = session.execute(insert(AvtTask).returning(AvtTask.id, sort_by_parameter_order=True), rows)
+                task_ids.extend(result.scalars().all())
+            session.commit()
+        except (SQLAlchemyError, KeyError) as e:
+            session.rollback()
+            print(f"Error adding tasks: {e}")
+            task_ids = []
+        finally:
+            session.close()
+        
+        return task_ids
+
+    @db_operation
     def update_task(self, task_id, **kwargs):
+        # write only: one UPDATE ... WHERE id = :id RETURNING id, task is not loaded before
+        # return False if no task matched
+        return len(self.update_tasks_where(AvtTask.id == task_id, **kwargs)) > 0
+
+    @db_operation
+    def update_tasks(self, task_ids, **kwargs):
+        # set the same values to many tasks by one UPDATE, return list of matched task ids
+        task_ids = list(task_ids)
+        if not task_ids:
+            return []
+        return self.update_tasks_where(AvtTask.id.in_(task_ids), **kwargs)
+
+    @db_operation
+    def update_unfinished_task(self, task_id, **kwargs):
+        # update task only if task_stat is not finished (1) or error (0) yet, return False if not updated
+        # NOT IN is not true for NULL, a task without task_stat is unfinished too
+        unfinished = or_(AvtTask.task_stat.is_(None), ~AvtTask.task_stat.in_(TERMINAL_TASK_STATS))
+        return len(self.update_tasks_where(AvtTask.id == task_id, unfinished, **kwargs)) > 0
+
+    @db_operation
+    def update_tasks_values(self, values_by_task_id):
+        # write different values to many tasks in one transaction, values_by_task_id: {task_id: {column: value}}
+        # Core executemany of UPDATE ... WHERE id = :task_id, one statement per set of columns
+        # (no rowcount check like ORM bulk update, a task deleted or archived meanwhile is simply not updated)
+        if not values_by_task_id:
+            return True
+
+        table = AvtTask.__table__
+        rows_by_columns = {}
+        for task_id, values in values_by_task_id.items():
+            rows_by_columns.setdefault(frozenset(values), []).append({**values, 'task_id': task_id})
         session = self.Session()
         
         try:
-            task = session.query(AvtTask).filter_by(id=task_id).first()
-            if not task:
-                return False
-            for key, value in kwargs.items():
-                setattr(task, key, value)
-            task.updated_at = datetime.now()
+            for rows in rows_by_columns.values():
+                # updated_at from the database clock, not from the clock of this worker
+                session.execute(table.update().where(table.c.id == bindparam('task_id')).values(updated_at=func.localtimestamp()), rows)
             session.commit()
             success = True
         except SQLAlchemyError as e:
             session.rollback()
-            print(f"Error updating task: {e}")
+            print(f"Error updating tasks: {e}")
             success = False
         finally:
             session.close()
         
         return success
 
+    def start_write_buffer(self, flush_interval=200, max_pending=100):
+        if self.write_buffer is None:
+            self.write_buffer = TaskWriteBuffer(self, flush_interval, max_pending)
+            self.write_buffer.start()
+
+    def stop_write_buffer(self):
+        # flush all pending updates
+        if self.write_buffer is not None:
+            self.write_buffer.stop()
+            self.write_buffer = None
+
+    def queue_task_update(self, task_id, **kwargs):
+        # update task through write buffer if started, else write now
+        if self.write_buffer is None:
+            return self.update_task(task_id, **kwargs)
+        return self.write_buffer.queue_update(task_id, **kwargs)
+
+    def flush_task_updates(self):
+        if self.write_buffer is None:
+            return True
+        return self.write_buffer.flush()
+
+    @db_operation
+    def update_tasks_where(self, *conditions, **kwargs):
+        session = self.Session()
+        
+        try:
+            kwargs['updated_at'] = func.localtimestamp() # database clock, same for all workers
+            updated_ids = session.execute(
+                update(AvtTask).where(*conditions).values(**kwargs).returning(AvtTask.id)
+            ).scalars().all()
+            session.commit()
+        except SQLAlchemyError as e:
+            session.rollback()
+            print(f"Error updating task: {e}")
+            updated_ids = []
+        finally:
+            session.close()
+        
+        return updated_ids
+
+    @db_operation
     def get_task_by_id(self, task_id):
+        # look in avt_task_archive too, so archived tasks can still be read by id
         session = self.Session()
         try:
             task = session.query(AvtTask).filter_by(id=task_id).first()
+            if not task and self.has_archive_table():
+                task = session.query(AvtTaskArchive).filter_by(id=task_id).first()
             if not task:
                 print(f"Task with ID {task_id} not found.")
                 return None
@@ -166,16 +769,130 @@ class Database:
             return None
         finally:
             session.close()
-    
-    def get_tasks(self, limit=None, offset=None):
+
+    @db_operation
+    def get_tasks_by_ids(self, task_ids):
+        # fetch many tasks (as TaskRow) in one round trip, return dict {task_id: task}
+        # missing ids are simply not in the result
+        task_ids = list(task_ids)
+        if not task_ids:
+            return {}
+
+        session = self.Session()
+        try:
+            rows = session.query(*TASK_ROW_COLUMNS).filter(AvtTask.id.in_(task_ids))
+            tasks = {row.id: TaskRow(*row) for row in rows}
+        except SQLAlchemyError as e:
+            print(f"Error retrieving tasks by IDs: {e}")
+            tasks = {}
+        finally:
+            session.close()
+
+        return tasks
+
+    @db_operation
+    def get_task_watermark(self):
+        # highest task id, start point for get_changes_since
+        session = self.Session()
+        try:
+            watermark = session.query(func.max(AvtTask.id)).scalar()
+        except SQLAlchemyError as e:
+            print(f"Error retrieving task watermark: {e}")
+            watermark = None
+        finally:
+            session.close()
+
+        return watermark
+
+    @db_operation
+    def get_changes_since(self, watermark=None, known_ids=None, id_window=CHANGE_FEED_ID_WINDOW):
+        # incremental feed of new and deleted tasks, return (new_tasks, deleted_ids, new_watermark)
+        # keyed on the task id (database sequence), not on created_at/updated_at which come from the clock of each writer
+        # - new_tasks: tasks with id above watermark - id_window which are not in known_ids, by id
+        #   tasks of the id window can be returned again on next calls, callers add them by id
+        #   tasks are TaskRow, task_param and task_output are not loaded (big Text columns)
+        #   updates of known tasks are not in the feed, callers refresh them by id (get_tasks_by_ids)
+        # - deleted_ids: ids of known_ids which are not in avt_task anymore
+        known_ids = set(known_ids or ())
+        session = self.Session()
+
+        try:
+            query = session.query(*TASK_ROW_COLUMNS)
+            if watermark is not None:
+                query = query.filter(AvtTask.id > watermark - id_window)
+            new_tasks = [TaskRow(*row) for row in query.order_by(AvtTask.id) if row.id not in known_ids]
+            if new_tasks:
+                watermark = new_tasks[-1].id if watermark is None else max(watermark, new_tasks[-1].id)
+
+            deleted_ids = []
+            if known_ids:
+                existing_ids = {task_id for (task_id,) in session.query(AvtTask.id).filter(AvtTask.id.in_(known_ids))}
+                deleted_ids = list(known_ids - existing_ids)
+        except SQLAlchemyError as e:
+            print(f"Error retrieving task changes: {e}")
+            new_tasks, deleted_ids = [], []
+        finally:
+            session.close()
+
+        return new_tasks, deleted_ids, watermark
+
+    @db_operation
+    def claim_next_task(self, worker_ip, task_types=None, process_id=None):
+        # atomically take the first waiting task (task_stat < 0, highest first, then oldest) of task_types for this worker
+        # a single row UPDATE ... RETURNING: waiting tasks are not renumbered, their task_stat only gives the order
+        # (renumbering the queue in the claim locked every waiting row, concurrent claims deadlocked)
+        # a head task of a type this worker does not serve (or disabled) is left to other workers, it does not block the queue
+        # FOR UPDATE SKIP LOCKED: a task being claimed by other worker is skipped, so no double execution and no lock waiting
+        # return claimed task id or None
         session = self.Session()
         
         try:
-            query = session.query(AvtTask).order_by(AvtTask.created_at.desc())
-            if limit:
-                query = query.limit(limit)
-            if offset:
-                query = query.offset(offset)
+            first_waiting = session.query(AvtTask.id).filter(AvtTask.task_stat < 0)
+            if task_types is not None:
+                first_waiting = first_waiting.filter(AvtTask.task_type.in_(list(task_types)))
+            first_waiting = first_waiting.order_by(AvtTask.task_stat.desc(), AvtTask.created_at, AvtTask.id).limit(1).with_for_update(skip_locked=True)
+            task_id = session.execute(
+                update(AvtTask).where(AvtTask.id == first_waiting.scalar_subquery(), AvtTask.task_stat < 0).values(
+                    task_stat=2, # running
+                    worker_ip=worker_ip,
+                    process_id=process_id,
+                    updated_at=func.localtimestamp()
+                ).returning(AvtTask.id)
+            ).scalar()
+            session.commit()
+        except SQLAlchemyError as e:
+            session.rollback()
+            print(f"Error claiming task: {e}")
+            task_id = None
+        finally:
+            session.close()
+        
+        return task_id
+
+    @staticmethod
+    def get_task_cursor(task):
+        # keyset pagination cursor of a task (AvtTask or TaskRow), pass it as before= to get older tasks
+        return (task.created_at, task.id)
+
+    @staticmethod
+    def paginate_tasks(query, limit=None, offset=None, before=None):
+        # newest first, before: cursor (created_at, id) of the last task of previous page
+        # keyset pagination on (created_at, id) does not re-scan previous pages like OFFSET does
+        query = query.order_by(AvtTask.created_at.desc(), AvtTask.id.desc())
+        if before is not None:
+            query = query.filter(tuple_(AvtTask.created_at, AvtTask.id) < tuple_(*before))
+        if limit:
+            query = query.limit(limit)
+        if offset:
+            query = query.offset(offset)
+        return query
+
+    @db_operation
+    def get_tasks(self, limit=None, offset=None, before=None):
+        session = self.Session()
+        
+        try:
+            query = self.paginate_tasks(session.query(AvtTask), limit, offset, before)
             tasks = query.all()
         except SQLAlchemyError as e:
             print(f"Error retrieving tasks: {e}")
@@ -185,6 +902,23 @@ class Database:
         
         return tasks
 
+    @db_operation
+    def get_task_rows(self, limit=None, offset=None, before=None):
+        # same as get_tasks but return TaskRow, for task list
+        session = self.Session()
+        
+        try:
+            query = self.paginate_tasks(session.query(*TASK_ROW_COLUMNS), limit, offset, before)
+            tasks = [TaskRow(*row) for row in query]
+        except SQLAlchemyError as e:
+            print(f"Error retrieving tasks: {e}")
+            tasks = []
+        finally:
+            session.close()
+        
+        return tasks
+
+    @db_operation
     def add_task_config(self, name, task_type, params=None, outputs=None, options=None, start_by=None, enable=True, content_html=None, order=None, parent_type=None):
         session = self.Session()
         
@@ -218,18 +952,18 @@ class Database:
         
         return config_id
 
+    @db_operation
     def update_task_config(self, config_id, **kwargs):
+        # write only, same as update_task
         session = self.Session()
         
         try:
-            config = session.query(TaskConfig).filter_by(id=config_id).first()
-            if not config:
-                return False
-            for key, value in kwargs.items():
-                setattr(config, key, value)
-            config.updated_at = datetime.now()
+            kwargs['updated_at'] = datetime.now()
+            updated_id = session.execute(
+                update(TaskConfig).where(TaskConfig.id == config_id).values(**kwargs).returning(TaskConfig.id)
+            ).scalar()
             session.commit()
-            success = True
+            success = updated_id is not None
         except SQLAlchemyError as e:
             session.rollback()
             print(f"Error updating task config: {e}")
@@ -239,11 +973,15 @@ class Database:
         
         return success
 
-    def get_task_configs(self, limit=None, offset=None):
+    @db_operation
+    def get_task_configs(self, limit=None, offset=None, after_id=None):
+        # ordered by id, after_id: id of the last config of previous page (keyset pagination)
         session = self.Session()
         
         try:
-            query = session.query(TaskConfig)
+            query = session.query(TaskConfig).order_by(TaskConfig.id)
+            if after_id is not None:
+                query = query.filter(TaskConfig.id > after_id)
             if limit:
                 query = query.limit(limit)
             if offset:
@@ -257,6 +995,224 @@ class Database:
         
         return configs
     
+    def get_pool_stats(self):
+        # snapshot of connection pool usage
+        pool = self.engine.pool
+        stats = self.pool_stats
+        with stats.lock:
+            return {
+                'size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'overflow': max(pool.overflow(), 0),
+                'connects': stats.connects,
+                'checkouts': stats.checkouts,
+                'invalidations': stats.invalidations,
+                'timeouts': stats.timeouts,
+                'avg_wait_ms': stats.total_wait_time / stats.checkouts * 1000 if stats.checkouts else 0,
+                'max_wait_ms': stats.max_wait_time * 1000
+            }
+
+    def get_query_stats(self, reset=False):
+        # per operation query count, errors, rows and latency histogram since start (or last reset)
+        return self.query_stats.snapshot(reset)
+
+    def dump_query_stats(self, file_path=None, reset=False):
+        # write query and pool stats as one json line to file_path, or print them
+        dump = {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'pool': self.get_pool_stats(),
+            'operations': self.get_query_stats(reset)
+        }
+        if file_path is None:
+            print(f"Database query stats: {json.dumps(dump, indent=4)}")
+            return
+        try:
+            with open(file_path, 'a') as stats_file:
+                stats_file.write(json.dumps(dump) + "\n")
+        except OSError as e:
+            print(f"Error writing query stats to {file_path}: {e}")
+
+    def start_query_stats_dump(self, interval, file_path=None):
+        # dump query stats every interval seconds from a background thread
+        if self.query_stats_thread is not None:
+            return
+        self.query_stats_stop.clear()
+        
+        def run():
+            while not self.query_stats_stop.wait(interval):
+                self.dump_query_stats(file_path)
+        self.query_stats_thread = threading.Thread(target=run, name="QueryStatsDump", daemon=True)
+        self.query_stats_thread.start()
+
+    def stop_query_stats_dump(self):
+        if self.query_stats_thread is None:
+            return
+        self.query_stats_stop.set()
+        self.query_stats_thread.join()
+        self.query_stats_thread = None
+
+    @db_operation
+    def ensure_indexes(self):
+        # create missing indexes of AvtTask and verify them, return True if all indexes exist and are valid
+        # CREATE INDEX CONCURRENTLY cannot run in a transaction, use autocommit connection
+        try:
+            with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+                for index in AvtTask.__table__.indexes:
+                    index.create(connection, checkfirst=True)
+                
+                existing_indexes = {index['name'] for index in inspect(connection).get_indexes(AvtTask.__tablename__)}
+                # a failed concurrent build leaves an invalid index which is never used
+                invalid_indexes = set(connection.execute(text(
+                    "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                    "WHERE i.indrelid = CAST(:table AS regclass) AND NOT i.indisvalid"
+                ), {'table': AvtTask.__tablename__}).scalars())
+        except SQLAlchemyError as e:
+            print(f"Error creating indexes: {e}")
+            return False
+        
+        success = True
+        for index in AvtTask.__table__.indexes:
+            if index.name not in existing_indexes:
+                print(f"Warning: index {index.name} is missing")
+                success = False
+            elif index.name in invalid_indexes:
+                print(f"Warning: index {index.name} is invalid, drop it and run ensure_indexes again")
+                success = False
+        return success
+
+    @db_operation
+    def check_query_plans(self):
+        # EXPLAIN hot queries, warn when one falls back to sequential scan of a big avt_task
+        # return list of names of queries using sequential scan
+        seq_scan_queries = []
+        try:
+            with self.engine.connect() as connection:
+                estimated_rows = connection.execute(text(
+                    "SELECT reltuples FROM pg_class WHERE oid = CAST(:table AS regclass)"
+                ), {'table': AvtTask.__tablename__}).scalar() or 0
+                if estimated_rows < SEQ_SCAN_WARNING_MIN_ROWS:
+                    return seq_scan_queries
+                
+                for name, query in HOT_TASK_QUERIES.items():
+                    plan = connection.execute(text(f"EXPLAIN (FORMAT JSON) {query}")).scalar()
+                    if isinstance(plan, str):
+                        plan = json.loads(plan)
+                    if self.plan_has_seq_scan(plan[0]['Plan'], AvtTask.__tablename__):
+                        print(f"Warning: query '{name}' uses sequential scan on {AvtTask.__tablename__} (~{int(estimated_rows)} rows), check indexes")
+                        seq_scan_queries.append(name)
+        except SQLAlchemyError as e:
+            print(f"Error checking query plans: {e}")
+        
+        return seq_scan_queries
+
+    @staticmethod
+    def plan_has_seq_scan(plan, table_name):
+        if plan.get('Node Type') == 'Seq Scan' and plan.get('Relation Name') == table_name:
+            return True
+        return any(Database.plan_has_seq_scan(sub_plan, table_name) for sub_plan in plan.get('Plans', []))
+
+    @db_operation
+    def get_task_configs_by_type(self, task_type):
+        # cached task configs of a task type, no query while cache is fresh
+        with self.task_config_cache_lock:
+            now = time.monotonic()
+            if self.task_config_cache_checked_at is None or now - self.task_config_cache_checked_at > self.task_config_cache_ttl:
+                self.reload_task_config_cache()
+                self.task_config_cache_checked_at = now
+            return self.task_config_cache.get(task_type, [])
+
+    def invalidate_task_config_cache(self):
+        # next get_task_configs_by_type checks database (ex: on task config change notification)
+        with self.task_config_cache_lock:
+            self.task_config_cache_checked_at = None
+
+    def reload_task_config_cache(self):
+        session = self.Session()
+        try:
+            version = tuple(session.query(
+                func.max(func.coalesce(TaskConfig.updated_at, TaskConfig.created_at)), func.count(TaskConfig.id)
+            ).one())
+            if version == self.task_config_cache_version:
+                return
+            
+            task_config_cache = {}
+            for config in session.query(TaskConfig).order_by(TaskConfig.order, TaskConfig.id):
+                task_config_cache.setdefault(config.type, []).append(config)
+            self.task_config_cache = task_config_cache
+            self.task_config_cache_version = version
+        except SQLAlchemyError as e:
+            print(f"Error loading task configs: {e}") # keep old cache
+        finally:
+            session.close()
+
+    def get_enabled_task_types(self, task_types):
+        # task types which are not disabled by their task configs (type without config is enabled)
+        enabled_task_types = []
+        for task_type in task_types:
+            configs = self.get_task_configs_by_type(task_type)
+            if not configs or any(config.enable is not False for config in configs):
+                enabled_task_types.append(task_type)
+        return enabled_task_types
+
+    @db_operation
+    def has_archive_table(self):
+        now = time.monotonic()
+        if not self.archive_table_exists and (self.archive_table_checked_at is None or now - self.archive_table_checked_at > self.archive_table_ttl):
+            try:
+                self.archive_table_exists = inspect(self.engine).has_table(AvtTaskArchive.__tablename__)
+            except SQLAlchemyError as e:
+                print(f"Error checking archive table: {e}")
+                return False
+            self.archive_table_checked_at = now
+        return bool(self.archive_table_exists)
+
+    @db_operation
+    def archive_finished_tasks(self, older_than_days=30, batch_size=1000, max_batches=None):
+        # move finished/error tasks not changed for older_than_days from avt_task to avt_task_archive by batches
+        # keep avt_task (live queue) small, return {'moved': rows, 'seconds': time, 'rows_per_second': rate}
+        try:
+            AvtTaskArchive.__table__.create(self.engine, checkfirst=True)
+            self.archive_table_exists = True
+        except SQLAlchemyError as e:
+            print(f"Error creating archive table: {e}")
+            return {'moved': 0, 'seconds': 0, 'rows_per_second': 0}
+        
+        cutoff = datetime.now() - timedelta(days=older_than_days)
+        moved = 0
+        batches = 0
+        start_time = time.perf_counter()
+        try:
+            while max_batches is None or batches < max_batches:
+                with self.engine.begin() as connection:
+                    batch_moved = connection.execute(text(ARCHIVE_TASKS_SQL), {'cutoff': cutoff, 'batch_size': batch_size}).rowcount
+                moved += batch_moved
+                batches += 1
+                if batch_moved < batch_size:
+                    break
+        except SQLAlchemyError as e:
+            print(f"Error archiving tasks: {e}")
+        
+        seconds = time.perf_counter() - start_time
+        rows_per_second = moved / seconds if seconds > 0 else 0
+        print(f"Archived {moved} tasks in {seconds:.2f}s ({rows_per_second:.0f} rows/s)")
+        return {'moved': moved, 'seconds': seconds, 'rows_per_second': rows_per_second}
+
+    @db_operation
+    def install_task_notify_trigger(self):
+        # create triggers that NOTIFY on insert/update/delete of avt_task and avt_task_config, safe to call many times
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(text(TASK_NOTIFY_TRIGGER_SQL))
+                connection.execute(text(TASK_CONFIG_NOTIFY_TRIGGER_SQL))
+            return True
+        except SQLAlchemyError as e:
+            print(f"Error installing task notify trigger: {e}")
+            return False
+
+    def create_task_notification_listener(self, channel=TASK_NOTIFY_CHANNEL):
+        return TaskNotificationListener(self.db_url, channel)
+
+    @db_operation
     def test_connection(self):
         try:
             with self.engine.connect() as connection:
@@ -264,6 +1220,28 @@ class Database:
         except exc.SQLAlchemyError as e:
             raise Exception(f"Database connection failed: {e}")
         
+class AsyncDatabase:
+    # Awaitable version of Database with the same task/config API, ex: tasks = await async_db.get_tasks(limit=10)
+    # Each call runs on a worker thread with its own session, so many queries run concurrently (up to max_workers)
+    # and the asyncio (Qt) event loop is never blocked
+    def __init__(self, db: Database, max_workers=4):
+        self.db = db
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="AsyncDatabase")
+    
+    def __getattr__(self, name):
+        attr = getattr(self.db, name)
+        if not callable(attr):
+            return attr
+        
+        @functools.wraps(attr)
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(attr, *args, **kwargs))
+        return call
+    
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
 # Example usage
 if __name__ == "__main__":
 
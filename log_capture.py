@@ -0,0 +1,187 @@
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import gzip
+import os
+import selectors
+import shutil
+import threading
+
+LOG_MAX_BYTES = 50 * 1024 * 1024 # rotate a process log when it reaches this size
+LOG_BACKUP_COUNT = 3 # rotated (gzip) logs kept for each process log, ex: 12.log.4.gz, 12.log.5.gz, 12.log.6.gz
+LOG_READ_SIZE = 64 * 1024 # max bytes read from a pipe at once
+
+def compress_log(file_path, old_file_path=None):
+    # gzip a rotated log, then remove the oldest rotated log which is out of backup count
+    try:
+        with open(file_path, 'rb') as log_file, gzip.open(f"{file_path}.gz", 'wb') as gzip_file:
+            shutil.copyfileobj(log_file, gzip_file)
+        os.remove(file_path)
+        if old_file_path is not None and os.path.exists(old_file_path):
+            os.remove(old_file_path)
+    except OSError as e:
+        print(f"Error compressing process log {file_path}: {e}")
+
+def read_log_tail(file_path, max_bytes):
+    # last max_bytes of a log (from first full line), return (text, position of end of file)
+    # position: (inode, offset), the inode tells a rotated log from the same log
+    try:
+        with open(file_path, 'rb') as log_file:
+            inode = os.fstat(log_file.fileno()).st_ino
+            size = log_file.seek(0, os.SEEK_END)
+            start = max(size - max_bytes, 0)
+            log_file.seek(start)
+            data = log_file.read(size - start)
+    except OSError:
+        return "", (None, 0)
+    if start > 0: # skip partial first line
+        data = data[data.find(b'\n') + 1:]
+    # only complete lines, rest is read next time
+    end = data.rfind(b'\n') + 1
+    return data[:end].decode(errors='replace'), (inode, size - len(data) + end)
+
+def read_log_since(file_path, position, max_bytes):
+    # text appended to a log since position, return (text, new position)
+    # a new log file (rotated, or task restarted) is read again from start
+    inode, offset = position
+    try:
+        with open(file_path, 'rb') as log_file:
+            stat = os.fstat(log_file.fileno())
+            if stat.st_ino != inode or stat.st_size < offset:
+                inode, offset = stat.st_ino, 0
+            if stat.st_size == offset:
+                return "", (inode, offset)
+            if stat.st_size - offset > max_bytes: # too much new data, only keep the tail
+                return read_log_tail(file_path, max_bytes)
+            log_file.seek(offset)
+            data = log_file.read(stat.st_size - offset)
+    except OSError:
+        return "", position
+    end = data.rfind(b'\n') + 1
+    return data[:end].decode(errors='replace'), (inode, offset + end)
+
+class RotatingLogWriter:
+    # Process log file rotated by size, rotated logs are compressed in background
+    # errors never raise (the capture thread is shared by all processes): data is dropped until the log can be written again
+    def __init__(self, file_path, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT, compress_executor=None):
+        self.file_path = file_path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.compress_executor = compress_executor
+        self.rotation = 0
+        # rotated logs of a previous run of the same task
+        for old_file_path in glob.glob(f"{glob.escape(file_path)}.*.gz"):
+            os.remove(old_file_path)
+        self.file = open(file_path, 'wb', buffering=0) # unbuffered, log is readable as soon as written
+        self.size = 0
+        self.error_reported = False # report only the first error of a log
+
+    def report_error(self, action, error):
+        if not self.error_reported:
+            print(f"Error {action} process log {self.file_path}: {error}")
+            self.error_reported = True
+
+    def write(self, data):
+        if self.file is None and not self.reopen():
+            return
+        try:
+            self.file.write(data)
+        except OSError as e: # ex: disk full, drop data but keep draining the pipe
+            self.report_error("writing", e)
+            return
+        self.size += len(data)
+        if self.max_bytes and self.size >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        rotated_file_path = f"{self.file_path}.{self.rotation + 1}"
+        try:
+            os.replace(self.file_path, rotated_file_path)
+        except OSError as e: # ex: log dir removed, keep writing the current file, retry after max_bytes more
+            self.report_error("rotating", e)
+            self.size = 0
+            return
+        self.rotation += 1
+        self.close()
+        old_file_path = f"{self.file_path}.{self.rotation - self.backup_count}.gz" if self.rotation > self.backup_count else None
+        if self.compress_executor is not None:
+            self.compress_executor.submit(compress_log, rotated_file_path, old_file_path)
+        else:
+            compress_log(rotated_file_path, old_file_path)
+        self.reopen()
+
+    def reopen(self):
+        # new log file after rotation, None (data dropped) while it cannot be created
+        try:
+            self.file = open(self.file_path, 'wb', buffering=0)
+        except OSError as e:
+            self.report_error("opening", e)
+            self.file = None
+            return False
+        self.size = 0
+        return True
+
+    def close(self):
+        if self.file is not None:
+            try:
+                self.file.close()
+            except OSError as e:
+                self.report_error("closing", e)
+            self.file = None
+
+class LogCapture:
+    # One thread reads the stdout/stderr pipes of all module processes and writes them to their log files
+    # (instead of letting modules write to an unbounded file)
+    instance = None
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.pending = [] # [(pipe fd, writer)] to register in the capture thread
+        self.pending_lock = threading.Lock()
+        self.wakeup_read, self.wakeup_write = os.pipe() # wake up select to register new pipes
+        self.selector.register(self.wakeup_read, selectors.EVENT_READ, None)
+        self.compress_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="LogCompress")
+        self.thread = threading.Thread(target=self.run, name="LogCapture", daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def get_instance(cls):
+        if cls.instance is None:
+            cls.instance = cls()
+        return cls.instance
+
+    def create_writer(self, file_path, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT):
+        return RotatingLogWriter(file_path, max_bytes, backup_count, self.compress_executor)
+
+    def add(self, pipe_fd, writer: RotatingLogWriter):
+        # capture pipe_fd (owned by the capture from now, closed at end of file) into writer
+        with self.pending_lock:
+            self.pending.append((pipe_fd, writer))
+        os.write(self.wakeup_write, b'\0')
+
+    def run(self):
+        while True:
+            for key, _ in self.selector.select():
+                if key.data is None:
+                    os.read(self.wakeup_read, 4096)
+                    with self.pending_lock:
+                        pending, self.pending = self.pending, []
+                    for pipe_fd, writer in pending:
+                        try:
+                            self.selector.register(pipe_fd, selectors.EVENT_READ, writer)
+                        except (OSError, ValueError) as e: # invalid pipe fd
+                            print(f"Error capturing process output for {writer.file_path}: {e}")
+                            writer.close()
+                    continue
+
+                # an error on one pipe only ends the capture of that pipe, never the thread
+                try:
+                    data = os.read(key.fd, LOG_READ_SIZE)
+                except OSError as e:
+                    print(f"Error reading process output for {key.data.file_path}: {e}")
+                    data = b''
+                if data:
+                    key.data.write(data)
+                else: # process (and its children) closed the pipe
+                    self.selector.unregister(key.fd)
+                    os.close(key.fd)
+                    key.data.close()
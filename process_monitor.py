@@ -1,7 +1,282 @@
 import psutil
 import subprocess
-from PyQt5.QtCore import QObject, pyqtSignal, QTimer
+from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot, QTimer, QThread, QMetaObject, Qt, QSocketNotifier
 import os
+import shlex
+import threading
+import time
+from task_metrics import TaskMetrics
+from unresponsive_detector import UnresponsiveDetector, UnresponsiveConfig
+from task_cgroup import TaskCgroupManager, CgroupLimits
+from log_capture import LogCapture
+from exit_code import EXIT_GENERAL_ERROR, EXIT_COMMAND_CANNOT_EXCUTE, EXIT_COMMAND_NOT_FOUND
+
+CPU_COUNT = psutil.cpu_count()
+
+# usage summed over a process tree
+# cpu_percent in % of one core, cpu_time in seconds, rss/io_bytes in bytes, ctx_switches: voluntary context switches
+# read_bytes/write_bytes: disk (storage) io, io_bytes is their sum
+# read_chars/write_chars: bytes of all read/write syscalls (disk cache, network sockets, pipes), 0 when not available
+# fds: open file descriptors
+TREE_USAGE_KEYS = ('cpu_percent', 'cpu_time', 'rss', 'io_bytes', 'read_bytes', 'write_bytes', 'read_chars', 'write_chars',
+                   'threads', 'ctx_switches', 'fds')
+# io counters of a task turned into rates (bytes/s)
+IO_RATE_KEYS = ('read_bytes', 'write_bytes', 'read_chars', 'write_chars')
+
+def get_io_usage(io_counters):
+    # io usage keys from psutil io_counters (None: access denied), read_chars/write_chars only exist on Linux
+    if io_counters is None:
+        return {'io_bytes': 0, 'read_bytes': 0, 'write_bytes': 0, 'read_chars': 0, 'write_chars': 0}
+    return {
+        'io_bytes': io_counters.read_bytes + io_counters.write_bytes,
+        'read_bytes': io_counters.read_bytes,
+        'write_bytes': io_counters.write_bytes,
+        'read_chars': getattr(io_counters, 'read_chars', 0),
+        'write_chars': getattr(io_counters, 'write_chars', 0)
+    }
+
+def count_open_fds(pid):
+    # counted only for monitored processes, listing the fds of every process of the host is too costly per tick
+    try:
+        return len(os.listdir(f"/proc/{pid}/fd"))
+    except OSError: # ended, access denied or no procfs
+        return 0
+
+class ProcessTableScan:
+    # One read of the host process table (single process_iter), with a ppid index to aggregate process trees
+    # cost is O(processes on the host) per tick, whatever the number of monitored trees
+    def __init__(self, previous=None):
+        self.time = time.monotonic()
+        self.usage = {} # {pid: {usage key: value}}, see TREE_USAGE_KEYS
+        self.status = {} # {pid: psutil status}
+        self.children = {} # {ppid: [pid]}
+        
+        elapsed = self.time - previous.time if previous is not None else 0
+        for proc in psutil.process_iter(['ppid', 'cpu_times', 'memory_info', 'io_counters', 'num_threads', 'num_ctx_switches', 'status']):
+            info = proc.info
+            if info['cpu_times'] is None or info['memory_info'] is None: # access denied
+                continue
+            pid = proc.pid
+            cpu_time = info['cpu_times'].user + info['cpu_times'].system
+            # new process (not in previous scan) is only primed, 0% at its first scan
+            previous_usage = previous.usage.get(pid) if previous is not None else None
+            if previous_usage is None or elapsed <= 0:
+                cpu_percent = 0
+            else:
+                cpu_percent = max(cpu_time - previous_usage['cpu_time'], 0) / elapsed * 100 # pid reused: no negative
+            ctx_switches = info['num_ctx_switches']
+            self.usage[pid] = {
+                'cpu_percent': cpu_percent,
+                'cpu_time': cpu_time,
+                'rss': info['memory_info'].rss,
+                **get_io_usage(info['io_counters']),
+                'threads': info['num_threads'] or 0,
+                'ctx_switches': ctx_switches.voluntary if ctx_switches is not None else 0,
+                'fds': 0 # counted by get_tree_usage
+            }
+            self.status[pid] = info['status']
+            self.children.setdefault(info['ppid'], []).append(pid)
+    
+    def get_status(self, pid):
+        return self.status.get(pid)
+    
+    def get_tree_usage(self, root_pid):
+        # usage of root_pid and all its descendants, NoSuchProcess if root_pid is not running
+        if root_pid not in self.usage:
+            raise psutil.NoSuchProcess(root_pid)
+        total_usage = dict.fromkeys(TREE_USAGE_KEYS, 0)
+        pids = [root_pid]
+        while pids:
+            pid = pids.pop()
+            usage = self.usage[pid]
+            for key in TREE_USAGE_KEYS:
+                total_usage[key] += usage[key]
+            total_usage['fds'] += count_open_fds(pid)
+            pids.extend(self.children.get(pid, ()))
+        return total_usage
+
+# in seconds, time given to a killed process tree to terminate before it is killed
+KILL_TIMEOUT = 5
+KILL_CHECK_INTERVAL = 100 # in ms
+# in seconds, max wait for the processes of an ended task cgroup to be gone before removing it
+CGROUP_REMOVE_TIMEOUT = 1.0
+# in seconds, max wait to reap the main process of a killed task when its exit is not watched by pidfd
+KILL_REAP_TIMEOUT = 1.0
+
+class ProcessSampler(QObject):
+    # One timer samples the processes of all ProcessMonitors, instead of timers in each monitor
+    # monitors are registered when their process starts and removed when it ends,
+    # the timer only runs while a process is live, so idle and finished tasks cost nothing
+    # The sampler lives in its own thread: psutil tree walks and kill escalation never block the GUI,
+    # monitors signals emitted from this thread are queued to the widgets in the GUI thread
+    instance = None
+    
+    signal_start_timer = pyqtSignal()
+    signal_stop_timer = pyqtSignal()
+    signal_kill_requested = pyqtSignal(object)
+    signal_remove_cgroup_requested = pyqtSignal(object)
+    
+    def __init__(self, interval=500, batched=True):
+        super().__init__()
+        self.interval = interval # in ms
+        # batched: read the host process table once per tick for all monitors,
+        # else each monitor walks its own process tree
+        self.batched = batched
+        self.previous_scan = None
+        self.monitors = {} # {pid: ProcessMonitor}
+        self.monitors_lock = threading.Lock() # monitors are registered from GUI thread, sampled in sampler thread
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.sample)
+        self.pending_kills = [] # [(monitor, processes, deadline)]
+        self.pending_cgroup_removals = [] # [(task cgroup, deadline)]
+        # checks pending kills and cgroup removals while there are some
+        self.kill_timer = QTimer(self)
+        self.kill_timer.timeout.connect(self.check_pending_kills)
+        
+        # timers must be started/stopped in the sampler thread
+        self.signal_start_timer.connect(self.start_timer)
+        self.signal_stop_timer.connect(self.stop_timer)
+        self.signal_kill_requested.connect(self.kill_process_tree)
+        self.signal_remove_cgroup_requested.connect(self.remove_cgroup)
+        
+        self.thread = QThread()
+        self.thread.setObjectName("ProcessSampler")
+        self.moveToThread(self.thread)
+        self.thread.start()
+    
+    @classmethod
+    def get_instance(cls):
+        # shared sampler, created on first use (needs the Qt application)
+        if cls.instance is None:
+            cls.instance = cls()
+        return cls.instance
+    
+    @classmethod
+    def shutdown(cls):
+        # stop the shared sampler thread, before the application quits
+        if cls.instance is not None:
+            # timers can only be stopped in their thread
+            QMetaObject.invokeMethod(cls.instance, "stop_timers", Qt.BlockingQueuedConnection)
+            cls.instance.thread.quit()
+            cls.instance.thread.wait()
+            cls.instance = None
+    
+    def register(self, monitor):
+        with self.monitors_lock:
+            self.monitors[monitor.pid] = monitor
+        self.signal_start_timer.emit()
+    
+    def unregister(self, monitor):
+        with self.monitors_lock:
+            if self.monitors.get(monitor.pid) is monitor:
+                del self.monitors[monitor.pid]
+            empty = not self.monitors
+        if empty:
+            self.signal_stop_timer.emit()
+    
+    @pyqtSlot()
+    def start_timer(self):
+        if not self.timer.isActive():
+            self.timer.start(self.interval)
+    
+    @pyqtSlot()
+    def stop_timer(self):
+        with self.monitors_lock:
+            if self.monitors: # registered again meanwhile
+                return
+        self.timer.stop()
+        self.previous_scan = None
+    
+    @pyqtSlot()
+    def stop_timers(self):
+        self.timer.stop()
+        self.kill_timer.stop()
+        for cgroup, _ in self.pending_cgroup_removals: # last try, do not leave task cgroups behind
+            cgroup.remove()
+        self.pending_cgroup_removals = []
+    
+    @pyqtSlot()
+    def sample(self):
+        with self.monitors_lock:
+            monitors = list(self.monitors.values()) # monitors unregister themselves when their process ends
+        if not monitors:
+            return
+        scan = None
+        if self.batched:
+            scan = ProcessTableScan(self.previous_scan)
+            self.previous_scan = scan
+        for monitor in monitors:
+            monitor.sample(scan)
+    
+    @pyqtSlot(object)
+    def kill_process_tree(self, monitor):
+        # terminate the process tree of monitor, survivors are killed after KILL_TIMEOUT without blocking the sampler
+        # in cgroup mode every process of the task cgroup is terminated, also the ones detached from the tree
+        monitor.stop_monitoring()
+        if monitor.cgroup is not None:
+            # the cgroup tells when every process is gone (not populated), no process list to keep
+            monitor.cgroup.terminate()
+            processes = []
+        else:
+            try:
+                parent_proc = psutil.Process(monitor.pid)
+                processes = parent_proc.children(recursive=True) + [parent_proc]
+            except psutil.NoSuchProcess:
+                processes = []
+            for proc in processes:
+                try:
+                    proc.terminate()
+                except psutil.NoSuchProcess:
+                    pass
+        self.pending_kills.append((monitor, processes, time.monotonic() + KILL_TIMEOUT))
+        self.check_pending_kills()
+        if self.pending_kills and not self.kill_timer.isActive():
+            self.kill_timer.start(KILL_CHECK_INTERVAL)
+    
+    @pyqtSlot()
+    def check_pending_kills(self):
+        pending_kills = []
+        for monitor, processes, deadline in self.pending_kills:
+            _, alive = psutil.wait_procs(processes, timeout=0)
+            cgroup_alive = monitor.cgroup is not None and monitor.cgroup.is_populated()
+            if (alive or cgroup_alive) and time.monotonic() < deadline:
+                pending_kills.append((monitor, alive, deadline))
+                continue
+            if cgroup_alive:
+                monitor.cgroup.kill() # no process of the task escapes
+            for proc in alive:
+                try:
+                    proc.kill()
+                except psutil.NoSuchProcess:
+                    pass
+            if not monitor.exit_watched:
+                # no pidfd to reap the main process (not in the process list in cgroup mode), do not leave a zombie
+                try:
+                    monitor.process.wait(timeout=KILL_REAP_TIMEOUT)
+                except subprocess.TimeoutExpired:
+                    print(f"Killed process {monitor.pid} did not exit in {KILL_REAP_TIMEOUT}s")
+            monitor.process_tree_killed()
+        self.pending_kills = pending_kills
+        self.check_pending_cgroup_removals()
+        if not self.pending_kills and not self.pending_cgroup_removals:
+            self.kill_timer.stop()
+    
+    @pyqtSlot(object)
+    def remove_cgroup(self, cgroup):
+        # remove an ended task cgroup once its killed processes are gone, polled by kill_timer instead of waiting
+        self.pending_cgroup_removals.append((cgroup, time.monotonic() + CGROUP_REMOVE_TIMEOUT))
+        self.check_pending_cgroup_removals()
+        if self.pending_cgroup_removals and not self.kill_timer.isActive():
+            self.kill_timer.start(KILL_CHECK_INTERVAL)
+    
+    def check_pending_cgroup_removals(self):
+        pending_cgroup_removals = []
+        for cgroup, deadline in self.pending_cgroup_removals:
+            if cgroup.is_populated() and time.monotonic() < deadline:
+                pending_cgroup_removals.append((cgroup, deadline))
+                continue
+            cgroup.remove()
+        self.pending_cgroup_removals = pending_cgroup_removals
 
 class ProcessMonitor(QObject):
     signal_running_time_update = pyqtSignal(float)  # in seconds
@@ -10,34 +285,75 @@ class ProcessMonitor(QObject):
     signal_process_killed = pyqtSignal()
     signal_process_cpu_usage_update = pyqtSignal(float)  # in %
     signal_process_ram_usage_update = pyqtSignal(float)  # in MB
-    signal_process_not_responding = pyqtSignal()
+    signal_process_not_responding = pyqtSignal(str) # reason
+    signal_process_rusage = pyqtSignal(dict) # resource usage of the exited process, emitted before signal_process_ended
+    signal_process_io_usage_update = pyqtSignal(dict) # {read_bytes, write_bytes, read_chars, write_chars: total bytes, <key>_rate: bytes/s}
+    signal_process_fds_update = pyqtSignal(int) # open file descriptors of the task
+    signal_process_threads_update = pyqtSignal(int)
     
-    def __init__(self, command):
+    def __init__(self, command, sampler: ProcessSampler = None, unresponsive_config: UnresponsiveConfig = None,
+                 cgroup_manager: TaskCgroupManager = None, cgroup_limits: CgroupLimits = None, cgroup_name=None):
         super().__init__()
         self.command = command
         self.process = None
         self.pid = None
+        self.sampler = sampler # shared sampler by default, get when process starts
+        self.monitoring = False
         
-        self.update_process_info_interval = 500
-        self.update_process_info_timer = QTimer(self)
-        self.update_process_info_timer.timeout.connect(self.update_process_info)
+        # optional cgroup v2 mode: the task runs in its own cgroup (limits, accounting, kill)
+        self.cgroup_manager = cgroup_manager
+        self.cgroup_limits = cgroup_limits
+        self.cgroup_name = cgroup_name
+        self.cgroup = None
         
-        self.update_running_time_interval = 500 # in ms
-        self.update_running_time_timer = QTimer(self)
-        self.update_running_time_timer.timeout.connect(self.update_time_excute)
+        # exit of the process is notified by its pidfd in the Qt event loop (Linux >= 5.3),
+        # else detected by the sampler when the process is gone
+        self.pidfd = None
+        self.exit_notifier = None # GUI thread only
+        self.exit_watched = False # exit notified by pidfd, set before monitoring starts, read by the sampler thread
+        # end of the process is handled once, it can be seen by the pidfd (GUI thread) and by the sampler thread
+        self.ended = False
+        self.end_lock = threading.Lock()
+        self.killing = False # killed processes end with signal_process_killed, not signal_process_ended
+        self.rusage = None
         
-        self.check_unresponsive_interval = 2000  # in ms
-        self.unresponsive_timer = QTimer(self)
-        self.unresponsive_timer.timeout.connect(self.check_unresponsive)
+        # hung task detection from cpu, io, context switches, log growth and heartbeat
+        self.unresponsive_config = unresponsive_config
+        self.unresponsive_detector = UnresponsiveDetector(unresponsive_config)
+        self.log_file_path = None
         
         self.no_process_counter = 0
         self.running_time = 0
         
-        self.previous_cpu_usage = []
-        self.previous_mem_usage = []
+        # cpu, ram, io and threads time series of the task, saved next to the process log when the task ends
+        # created when the process starts (~48 KB each), not for every task widget
+        self.metrics = None
+        self.metrics_file_path = None
+        self.previous_io = None # (time, info) of previous sample, to compute io rates
+        self.io_usage = None # last io usage emitted, tells io bound tasks (high rates, low cpu) from cpu bound ones
+        
+        # psutil.Process of the process tree, kept between samples so cpu_percent(None) measures since last sample
+        self.processes = {} # {pid: psutil.Process}
+    
+    def start_monitoring(self):
+        if self.sampler is None:
+            self.sampler = ProcessSampler.get_instance()
+        self.monitoring = True
+        self.sampler.register(self)
+    
+    def stop_monitoring(self):
+        if self.monitoring:
+            self.monitoring = False
+            self.sampler.unregister(self)
+            self.processes = {}
+    
+    def sample(self, scan=None):
+        # called by the sampler every sampler.interval ms while the process is monitored
+        self.update_time_excute()
+        self.update_process_info(scan)
         
     def update_time_excute(self):
-        self.running_time += self.update_running_time_interval/1000
+        self.running_time += self.sampler.interval/1000
         self.signal_running_time_update.emit(self.running_time)
         
     def start_process(self, log_file_path = "process_log.log"):
@@ -52,56 +368,211 @@ class ProcessMonitor(QObject):
         log_dir = os.path.dirname(log_file_path)
         if log_dir != "":
             os.makedirs(log_dir, exist_ok=True)
+        # metrics profile of the task is saved next to its log, ex: .process_log/12.metrics.json
+        self.metrics = TaskMetrics()
+        self.metrics_file_path = os.path.splitext(log_file_path)[0] + ".metrics.json"
+        self.previous_io = None
+        self.io_usage = None
+        self.log_file_path = log_file_path
+        self.unresponsive_detector = UnresponsiveDetector(self.unresponsive_config)
+        
+        self.killing = False
+        self.rusage = None
+        self.ended = False
+        self.exit_watched = False
+        
+        # output of the process is read from a pipe by the shared log capture thread, into a size rotated log
+        log_capture = LogCapture.get_instance()
+        try:
+            log_writer = log_capture.create_writer(log_file_path)
+        except OSError as e:
+            print(f"Cannot open process log {log_file_path}: {e}")
+            self.signal_process_ended.emit(EXIT_GENERAL_ERROR)
+            return
+        try:
+            self.process = self.popen_in_cgroup()
+            if self.process is None:
+                self.process = self.popen()
+        except OSError as e:
+            # no shell to report it, same exit codes as a shell
+            print(f"Cannot start process: {e}")
+            log_writer.write(f"Cannot start process: {e}\n".encode())
+            log_writer.close()
+            exit_code = EXIT_COMMAND_NOT_FOUND if isinstance(e, FileNotFoundError) else \
+                        EXIT_COMMAND_CANNOT_EXCUTE if isinstance(e, PermissionError) else EXIT_GENERAL_ERROR
+            self.remove_cgroup()
+            self.signal_process_ended.emit(exit_code)
+            return
+        # the capture owns its own copy of the pipe, closed when the process tree closes its output
+        log_capture.add(os.dup(self.process.stdout.fileno()), log_writer)
+        self.process.stdout.close()
+        self.pid = self.process.pid
+        self.signal_process_started.emit(self.pid)
+        print(f"Process started with PID: {self.pid}")
         
-        with open(log_file_path, 'w') as log_file:
-            self.process = subprocess.Popen(
-                self.command,
-                shell=True,
-                stdout=log_file,
-                stderr=log_file
-            )
-            self.pid = self.process.pid
-            self.signal_process_started.emit(self.pid)
-            print(f"Process started with PID: {self.pid}")
-        
-        # Start the timer to monitor the process
-        self.update_process_info_timer.start(self.update_process_info_interval)  # Update process info every 1000 ms (1 second)
-        self.update_running_time_timer.start(self.update_running_time_interval)
-        self.unresponsive_timer.start(self.check_unresponsive_interval)
+        self.watch_process_exit()
+        
+        # monitor the process by the shared sampler
         self.running_time = 0
+        self.start_monitoring()
+    
+    def popen(self, preexec_fn=None):
+        # no shell: the command is split into arguments and executed directly, in its own session and process group
+        # stdout and stderr go to one pipe, read by the log capture
+        return subprocess.Popen(
+            shlex.split(self.command),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+            preexec_fn=preexec_fn
+        )
+    
+    def watch_process_exit(self):
+        # pidfd of the process becomes readable when it exits, no polling
+        try:
+            self.pidfd = os.pidfd_open(self.pid)
+        except (AttributeError, OSError) as e: # not Linux >= 5.3, the sampler detects exit
+            print(f"Process exit notification not available, detect it by sampling: {e}")
+            self.pidfd = None
+            return
+        self.exit_notifier = QSocketNotifier(self.pidfd, QSocketNotifier.Read, self)
+        self.exit_notifier.activated.connect(self.process_exited)
+        self.exit_watched = True
+    
+    def process_exited(self):
+        # process exited: reap it now for its exit code and rusage, in the GUI thread
+        self.exit_notifier.setEnabled(False)
+        self.exit_notifier.deleteLater()
+        self.exit_notifier = None
+        os.close(self.pidfd)
+        self.pidfd = None
         
+        try:
+            _, status, rusage = os.wait4(self.pid, 0) # ready, does not block
+            exit_code = os.waitstatus_to_exitcode(status)
+            self.process.returncode = exit_code # already reaped, keep Popen consistent
+            self.rusage = {
+                'user_time': rusage.ru_utime, # in seconds
+                'system_time': rusage.ru_stime,
+                'max_rss': rusage.ru_maxrss / 1024, # in MB, largest process of the tree
+                'block_input': rusage.ru_inblock,
+                'block_output': rusage.ru_oublock,
+                'voluntary_ctx_switches': rusage.ru_nvcsw,
+                'involuntary_ctx_switches': rusage.ru_nivcsw
+            }
+        except ChildProcessError: # already reaped (poll, kill)
+            exit_code = self.process.returncode if self.process.returncode is not None else 0
+        
+        if self.killing: # signal_process_killed is emitted by the kill escalation
+            return
+        if self.rusage is not None:
+            self.signal_process_rusage.emit(self.rusage)
+        self.end_process(exit_code)
+    
+    def mark_ended(self):
+        # True for the first caller only, the process end is handled once
+        with self.end_lock:
+            if self.ended:
+                return False
+            self.ended = True
+            return True
+    
+    def end_process(self, exit_code):
+        if not self.mark_ended():
+            return
+        self.stop_monitoring()
+        if self.cgroup is not None:
+            self.cgroup.kill() # main process ended, do not leave its children running
+        self.save_metrics()
+        self.remove_cgroup()
+        self.signal_process_ended.emit(exit_code)
+        self.signal_process_cpu_usage_update.emit(0)
+        self.signal_process_ram_usage_update.emit(0)
+        self.emit_no_usage()
+        
+    def emit_no_usage(self):
+        # process ended, clear io, fds and threads of the task (total bytes are kept)
+        io_usage = {key: (self.io_usage or {}).get(key, 0) for key in IO_RATE_KEYS}
+        io_usage.update({f'{key}_rate': 0 for key in IO_RATE_KEYS})
+        self.signal_process_io_usage_update.emit(io_usage)
+        self.signal_process_fds_update.emit(0)
+        self.signal_process_threads_update.emit(0)
+        
+    def popen_in_cgroup(self):
+        # start the process in a new task cgroup, None if cgroup mode is off or failed (fall back to plain start)
+        if self.cgroup_manager is None:
+            return None
+        self.cgroup = self.cgroup_manager.create_task_cgroup(self.cgroup_name or f"task_{os.getpid()}_{id(self)}", self.cgroup_limits)
+        if self.cgroup is None:
+            return None
+        try:
+            procs_fd = self.cgroup.open_procs()
+        except OSError as e:
+            print(f"Error opening task cgroup, start without cgroup: {e}")
+            self.remove_cgroup()
+            return None
+        try:
+            # the child moves itself in the cgroup before exec, so all its children are created in it
+            return self.popen(preexec_fn=lambda: os.write(procs_fd, b"0"))
+        except subprocess.SubprocessError as e:
+            print(f"Error starting process in task cgroup, start without cgroup: {e}")
+            self.remove_cgroup()
+            return None
+        finally:
+            os.close(procs_fd)
+    
+    def remove_cgroup(self):
+        # removed by the sampler thread, never waits for the killed processes in the GUI thread
+        if self.cgroup is not None:
+            if self.sampler is None:
+                self.sampler = ProcessSampler.get_instance()
+            self.sampler.signal_remove_cgroup_requested.emit(self.cgroup)
+            self.cgroup = None
+    
     def set_process_id(self, pid):
         self.pid = pid
     
-    def get_process_info(self):
+    def get_process_info(self, scan=None):
+        # scan: ProcessTableScan of the sampler in batched mode, else walk the process tree of this monitor
         if self.pid is None:
             print("No process started")
             return None
         
         try:
-            proc = psutil.Process(self.pid)
-            # Check if the process is a zombie
-            if proc.status() == psutil.STATUS_ZOMBIE:
-                print(f"Process {self.pid} is a defunct (zombie) process.")
-                return None
-            
-            # Get the total CPU and memory usage of the main process and its children
-            total_cpu_usage = proc.cpu_percent(interval=0.1)
-            total_memory_usage = proc.memory_info().rss
-
-            for child in proc.children(recursive=True):
-                total_cpu_usage += child.cpu_percent(interval=0.1)
-                total_memory_usage += child.memory_info().rss
-
-            total_cpu_usage /= psutil.cpu_count()  # Adjust for the number of CPU cores
-            total_memory_usage /= (1024 * 1024)  # Convert bytes to MB
+            if self.cgroup is not None:
+                # task ends when every process of its cgroup ended
+                if not self.cgroup.is_populated():
+                    return None
+                usage = self.cgroup.get_usage()
+                self.add_cgroup_process_usage(usage)
+            elif scan is not None:
+                if scan.get_status(self.pid) == psutil.STATUS_ZOMBIE:
+                    print(f"Process {self.pid} is a defunct (zombie) process.")
+                    return None
+                usage = scan.get_tree_usage(self.pid)
+            else:
+                proc = self.processes.get(self.pid) or psutil.Process(self.pid)
+                # Check if the process is a zombie
+                if proc.status() == psutil.STATUS_ZOMBIE:
+                    print(f"Process {self.pid} is a defunct (zombie) process.")
+                    return None
+                usage = self.get_tree_usage(proc)
 
             return {
                 'pid': self.pid,
-                'total_cpu_usage': total_cpu_usage,
-                'total_memory_usage': total_memory_usage
+                'total_cpu_usage': usage['cpu_percent'] / CPU_COUNT,  # Adjust for the number of CPU cores
+                'total_memory_usage': usage['rss'] / (1024 * 1024),  # Convert bytes to MB
+                'total_cpu_time': usage['cpu_time'],
+                'total_io_bytes': usage['io_bytes'],
+                'total_read_bytes': usage['read_bytes'],
+                'total_write_bytes': usage['write_bytes'],
+                'total_read_chars': usage['read_chars'],
+                'total_write_chars': usage['write_chars'],
+                'total_threads': usage['threads'],
+                'total_ctx_switches': usage['ctx_switches'],
+                'total_fds': usage['fds']
             }
-        except psutil.NoSuchProcess:
+        except (psutil.NoSuchProcess, OSError): # OSError: task cgroup files not readable
             self.no_process_counter += 1
             if self.no_process_counter > 5:
                 print("Process not found")
@@ -109,8 +580,59 @@ class ProcessMonitor(QObject):
             else:
                 return self.no_process_counter
 
-    def update_process_info(self):
-        info = self.get_process_info()
+    def add_cgroup_process_usage(self, usage):
+        # fds and syscall io are not accounted by cgroup, sum them over the processes of the task cgroup
+        for pid in self.cgroup.get_pids():
+            try:
+                io_counters = psutil.Process(pid).io_counters()
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+            usage['read_chars'] += getattr(io_counters, 'read_chars', 0)
+            usage['write_chars'] += getattr(io_counters, 'write_chars', 0)
+            usage['fds'] += count_open_fds(pid)
+    
+    def get_tree_usage(self, proc):
+        # Get the total usage of the main process and its children, see TREE_USAGE_KEYS
+        # cpu_percent(None) never sleeps, it compares cpu times with the previous sample of the same Process
+        total_usage = self.sample_process(proc)
+        
+        tree_pids = {self.pid}
+        for child in proc.children(recursive=True):
+            tree_pids.add(child.pid)
+            try:
+                usage = self.sample_process(self.processes.get(child.pid, child))
+            except (psutil.NoSuchProcess, psutil.ZombieProcess): # child ended since listed
+                continue
+            for key in TREE_USAGE_KEYS:
+                total_usage[key] += usage[key]
+        
+        # forget ended children, stop_monitoring can replace self.processes meanwhile (GUI thread)
+        processes = self.processes
+        for pid in processes.keys() - tree_pids:
+            processes.pop(pid, None)
+        return total_usage
+
+    def sample_process(self, proc):
+        # usage of one process, new process is cached and only primed (0% at its first sample)
+        with proc.oneshot():
+            cpu_times = proc.cpu_times()
+            usage = {
+                'cpu_percent': proc.cpu_percent(None),
+                'cpu_time': cpu_times.user + cpu_times.system,
+                'rss': proc.memory_info().rss,
+                'threads': proc.num_threads(),
+                'ctx_switches': proc.num_ctx_switches().voluntary,
+                'fds': count_open_fds(proc.pid)
+            }
+            try:
+                usage.update(get_io_usage(proc.io_counters()))
+            except psutil.AccessDenied:
+                usage.update(get_io_usage(None))
+        self.processes[proc.pid] = proc
+        return usage
+
+    def update_process_info(self, scan=None):
+        info = self.get_process_info(scan)
         if isinstance(info, int):
             # print(f"Lost monitoring, Trying to find process by ID, tried: {info}")
             return
@@ -119,59 +641,85 @@ class ProcessMonitor(QObject):
             # print(f"PID: {info['pid']} - Total CPU Usage: {info['total_cpu_usage']}% - Total Memory Usage: {info['total_memory_usage']} MB")
             self.signal_process_cpu_usage_update.emit(info['total_cpu_usage'])
             self.signal_process_ram_usage_update.emit(info['total_memory_usage'])
+            self.signal_process_fds_update.emit(info['total_fds'])
+            self.signal_process_threads_update.emit(info['total_threads'])
             self.no_process_counter = 0
-            
-            self.previous_cpu_usage.append(info['total_cpu_usage'])
-            self.previous_mem_usage.append(info['total_memory_usage'])
-            if len(self.previous_cpu_usage) > 60:
-                self.previous_cpu_usage.pop(0)
-                self.previous_mem_usage.pop(0)
-        else:
+            self.add_metrics_sample(info)
+            self.check_unresponsive(info)
+        elif not self.exit_watched: # with pidfd, exit is handled by process_exited
             if self.process and self.process.poll() is not None:
                 exit_code = self.process.returncode
-                self.signal_process_ended.emit(exit_code)
             else:
-                self.signal_process_ended.emit(0)
-                
-            self.update_process_info_timer.stop()  # Stop the timer
-            self.update_running_time_timer.stop()
-            self.unresponsive_timer.stop()
-            # self.signal_process_ended.emit()
-            self.signal_process_cpu_usage_update.emit(0)
-            self.signal_process_ram_usage_update.emit(0)
+                exit_code = 0
+            self.end_process(exit_code)
+    
+    def add_metrics_sample(self, info):
+        now = time.time()
+        io_usage = {}
+        for key in IO_RATE_KEYS:
+            io_usage[key] = info[f'total_{key}']
+            io_usage[f'{key}_rate'] = 0 # first sample only primes
+            if self.previous_io is not None and now > self.previous_io[0]:
+                # io bytes of the tree drop when a child exits, no negative rate
+                io_usage[f'{key}_rate'] = max(io_usage[key] - self.previous_io[1][f'total_{key}'], 0) / (now - self.previous_io[0])
+        self.previous_io = (now, info)
+        self.io_usage = io_usage
+        self.signal_process_io_usage_update.emit(io_usage)
+        io_rate = io_usage['read_bytes_rate'] + io_usage['write_bytes_rate']
+        if self.metrics is not None:
+            self.metrics.add_sample(now, info['total_cpu_usage'], info['total_memory_usage'], io_rate, info['total_threads'])
+    
+    def save_metrics(self):
+        if self.metrics is not None and self.metrics_file_path is not None:
+            self.metrics.save_to_json(self.metrics_file_path, {'rusage': self.rusage})
 
-    def check_unresponsive(self):
-        if len(self.previous_cpu_usage) >= 60: # 10s - base on update infor timer
-            # if dont use CPU or RAM in 30s, set as non responding
-            if all(usage == 0 for usage in self.previous_cpu_usage) and len(set(self.previous_mem_usage)) == 1:
-                print(f"Process auto emit non-responding signal - PID: {self.pid}")
-                self.signal_process_not_responding.emit()
+    def get_log_size(self):
+        try:
+            return os.path.getsize(self.log_file_path) if self.log_file_path is not None else 0
+        except OSError:
+            return 0
+    
+    def record_heartbeat(self):
+        # module updated its task in database (task_stat/updated_at changed)
+        self.unresponsive_detector.record_heartbeat()
+    
+    def check_unresponsive(self, info):
+        was_unresponsive = self.unresponsive_detector.unresponsive
+        unresponsive = self.unresponsive_detector.add_sample({
+            'cpu': info['total_cpu_time'],
+            # disk io and syscall io, network transfer (ex: FTP) is activity too
+            'io': info['total_io_bytes'] + info['total_read_chars'] + info['total_write_chars'],
+            'ctx_switches': info['total_ctx_switches'],
+            'log': self.get_log_size()
+        })
+        if unresponsive and not was_unresponsive: # emit once per hang
+            reason = self.unresponsive_detector.reason
+            print(f"Process auto emit non-responding signal - PID: {self.pid} - {reason}")
+            self.signal_process_not_responding.emit(reason)
     
     def kill_process(self):
-        if self.process and self.process.poll() is None:
+        if self.process and self.process.returncode is None:
             print("Force killing process")
-            parent_proc = psutil.Process(self.pid)
-            children = parent_proc.children(recursive=True)
-            for child in children:
-                child.terminate()
-            parent_proc.terminate()
-            _, alive = psutil.wait_procs(children + [parent_proc], timeout=5)
-            for proc in alive:
-                proc.kill()
-            self.signal_process_killed.emit()
-            self.update_process_info_timer.stop()
-            self.update_running_time_timer.stop()
-            
-            self.signal_process_cpu_usage_update.emit(0)
-            self.signal_process_ram_usage_update.emit(0)
-            self.unresponsive_timer.stop()
-            print("Process terminated")
+            self.killing = True
+            if self.sampler is None:
+                self.sampler = ProcessSampler.get_instance()
+            self.sampler.signal_kill_requested.emit(self) # terminate/kill in sampler thread
         else:
             print("No process running to kill")
+            self.stop_monitoring()
             self.signal_process_ended.emit(0) # consider that process finished
-            self.update_process_info_timer.stop()
-            self.update_running_time_timer.stop()
-            self.unresponsive_timer.stop()
+    
+    def process_tree_killed(self):
+        # called in sampler thread when all processes of the tree are gone
+        if not self.mark_ended():
+            return
+        self.save_metrics()
+        self.remove_cgroup()
+        self.signal_process_killed.emit()
+        self.signal_process_cpu_usage_update.emit(0)
+        self.signal_process_ram_usage_update.emit(0)
+        self.emit_no_usage()
+        print("Process terminated")
 
 # Example usage
 if __name__ == "__main__":
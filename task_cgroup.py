@@ -0,0 +1,210 @@
+import os
+import signal
+import time
+
+CPU_MAX_PERIOD = 100000 # in us, period of cpu.max quota
+# controllers enabled for task cgroups when the parent cgroup provides them
+TASK_CGROUP_CONTROLLERS = ('cpu', 'memory', 'io', 'pids')
+
+def find_cgroup2_mount():
+    # mount point of the cgroup v2 hierarchy (/sys/fs/cgroup, or /sys/fs/cgroup/unified in hybrid mode), None if not mounted
+    try:
+        with open('/proc/mounts', 'r') as mounts:
+            for line in mounts:
+                fields = line.split()
+                if len(fields) > 2 and fields[2] == 'cgroup2':
+                    return fields[1]
+    except OSError:
+        pass
+    return None
+
+def read_cgroup_file(path):
+    with open(path, 'r') as cgroup_file:
+        return cgroup_file.read().strip()
+
+def write_cgroup_file(path, value):
+    with open(path, 'w') as cgroup_file:
+        cgroup_file.write(value)
+
+def read_cgroup_keys(path):
+    # flat keyed file (cpu.stat, cgroup.events): {key: int}
+    values = {}
+    for line in read_cgroup_file(path).splitlines():
+        key, value = line.split()
+        values[key] = int(value)
+    return values
+
+class CgroupLimits:
+    # Resource limits of a task type, config.json section "cgroup":
+    # {"enabled": true, "parent": null, "default": {...}, "<task_type>": {...}}, values of the task type override default values
+    def __init__(self, cpus=None, memory_max=None):
+        self.cpus = cpus # in cores, cpu.max quota, None: no limit
+        self.memory_max = memory_max # in MB, memory.max, None: no limit
+
+    @classmethod
+    def from_dict(cls, section, task_type=None):
+        values = dict((section or {}).get('default', {}))
+        if task_type is not None:
+            values.update((section or {}).get(str(task_type), {}))
+        return cls(**values)
+
+class TaskCgroupManager:
+    # Parent cgroup of the task cgroups, one child cgroup is created for each started task
+    def __init__(self, parent_path, controllers):
+        self.parent_path = parent_path
+        self.controllers = controllers # controllers enabled for task cgroups
+
+    @classmethod
+    def setup(cls, parent=None, move_to_leaf=False):
+        # parent: delegated cgroup path (ex: /sys/fs/cgroup/wtm.slice), None: cgroup of this process
+        # move_to_leaf: allow to move this process in a "wtm" child of its own cgroup when parent is None
+        # return None if cgroup v2 is not mounted or not delegated to this user, tasks then run without cgroup
+        mount = find_cgroup2_mount()
+        if mount is None:
+            print("cgroup v2 is not mounted, run tasks without cgroup")
+            return None
+        if parent is None and not move_to_leaf:
+            print("cgroup parent is not set and moving WTM to a leaf cgroup is not allowed (move_to_leaf), run tasks without cgroup")
+            return None
+        try:
+            if parent is None:
+                # a cgroup with processes cannot enable controllers for its children (no internal process rule),
+                # move WTM in a leaf child "wtm", task cgroups are created beside it
+                own_path = next(line[3:] for line in read_cgroup_file('/proc/self/cgroup').splitlines() if line.startswith('0::'))
+                parent = os.path.join(mount, own_path.lstrip('/'))
+                leaf = os.path.join(parent, 'wtm')
+                print(f"Moving WTM (PID {os.getpid()}) to cgroup {leaf}")
+                os.makedirs(leaf, exist_ok=True)
+                write_cgroup_file(os.path.join(leaf, 'cgroup.procs'), str(os.getpid()))
+
+            available = read_cgroup_file(os.path.join(parent, 'cgroup.controllers')).split()
+            controllers = [controller for controller in TASK_CGROUP_CONTROLLERS if controller in available]
+            if controllers:
+                write_cgroup_file(os.path.join(parent, 'cgroup.subtree_control'), ' '.join(f"+{controller}" for controller in controllers))
+            if not os.access(parent, os.W_OK):
+                raise PermissionError(f"cannot create cgroup in {parent}")
+        except (OSError, StopIteration) as e:
+            print(f"cgroup v2 is not delegated, run tasks without cgroup: {e}")
+            return None
+
+        missing = [controller for controller in ('cpu', 'memory') if controller not in controllers]
+        if missing:
+            print(f"Warning: cgroup controllers {missing} not available in {parent}, their limits are not applied")
+        print(f"Task cgroups in {parent} - controllers: {controllers}")
+        return cls(parent, controllers)
+
+    def create_task_cgroup(self, name, limits: CgroupLimits = None):
+        # return TaskCgroup or None if it cannot be created (task runs without cgroup)
+        path = os.path.join(self.parent_path, name)
+        try:
+            os.makedirs(path, exist_ok=True)
+            task_cgroup = TaskCgroup(path)
+            task_cgroup.set_limits(limits, self.controllers)
+            return task_cgroup
+        except OSError as e:
+            print(f"Error creating task cgroup {path}: {e}")
+            return None
+
+class TaskCgroup:
+    # cgroup of one task: limits, accounting of all its processes and kill without escape
+    def __init__(self, path):
+        self.path = path
+        self.previous_cpu = None # (time, cpu time) of previous usage, to compute cpu percent
+
+    def get_file(self, name):
+        return os.path.join(self.path, name)
+
+    def set_limits(self, limits: CgroupLimits, controllers):
+        if limits is None:
+            return
+        if 'cpu' in controllers:
+            quota = int(limits.cpus * CPU_MAX_PERIOD) if limits.cpus is not None else 'max'
+            write_cgroup_file(self.get_file('cpu.max'), f"{quota} {CPU_MAX_PERIOD}")
+        if 'memory' in controllers:
+            memory_max = int(limits.memory_max * 1024 * 1024) if limits.memory_max is not None else 'max'
+            write_cgroup_file(self.get_file('memory.max'), str(memory_max))
+            write_cgroup_file(self.get_file('memory.oom.group'), '1') # OOM kills the whole task, not a random process of it
+
+    def open_procs(self):
+        # fd of cgroup.procs, the child process writes itself in it before exec (Popen preexec_fn)
+        return os.open(self.get_file('cgroup.procs'), os.O_WRONLY)
+
+    def get_pids(self):
+        try:
+            return [int(pid) for pid in read_cgroup_file(self.get_file('cgroup.procs')).split()]
+        except OSError:
+            return []
+
+    def is_populated(self):
+        try:
+            return read_cgroup_keys(self.get_file('cgroup.events')).get('populated', 0) == 1
+        except OSError:
+            return False
+
+    def get_usage(self):
+        # usage of every process of the task (same keys as process tree usage), read from cgroup files only
+        now = time.monotonic()
+        cpu_time = read_cgroup_keys(self.get_file('cpu.stat'))['usage_usec'] / 1e6
+        cpu_percent = 0 # first usage only primes
+        if self.previous_cpu is not None and now > self.previous_cpu[0]:
+            cpu_percent = max(cpu_time - self.previous_cpu[1], 0) / (now - self.previous_cpu[0]) * 100
+        self.previous_cpu = (now, cpu_time)
+
+        usage = {
+            'cpu_percent': cpu_percent,
+            'cpu_time': cpu_time,
+            'rss': 0,
+            'io_bytes': 0,
+            'read_bytes': 0,
+            'write_bytes': 0,
+            'read_chars': 0, # syscall io and fds are not accounted by cgroup
+            'write_chars': 0,
+            'threads': 0,
+            'ctx_switches': 0, # not accounted by cgroup
+            'fds': 0
+        }
+        if os.path.exists(self.get_file('memory.current')):
+            usage['rss'] = int(read_cgroup_file(self.get_file('memory.current')))
+        if os.path.exists(self.get_file('pids.current')):
+            usage['threads'] = int(read_cgroup_file(self.get_file('pids.current'))) # pids controller counts threads
+        if os.path.exists(self.get_file('io.stat')):
+            for line in read_cgroup_file(self.get_file('io.stat')).splitlines(): # one line per device
+                for field in line.split()[1:]:
+                    key, value = field.split('=')
+                    if key == 'rbytes':
+                        usage['read_bytes'] += int(value)
+                    elif key == 'wbytes':
+                        usage['write_bytes'] += int(value)
+            usage['io_bytes'] = usage['read_bytes'] + usage['write_bytes']
+        return usage
+
+    def terminate(self):
+        # SIGTERM every process of the task, also the ones detached from the process tree
+        for pid in self.get_pids():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def kill(self):
+        # SIGKILL every process of the task, cgroup.kill (kernel >= 5.14) also kills processes forking meanwhile
+        try:
+            write_cgroup_file(self.get_file('cgroup.kill'), '1')
+            return
+        except OSError:
+            pass
+        for pid in self.get_pids():
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def remove(self):
+        # remove the cgroup after the task ended, fails (EBUSY) while killed processes are not gone yet
+        # see ProcessSampler.remove_cgroup, which waits for it without blocking
+        try:
+            os.rmdir(self.path)
+            return True
+        except OSError as e:
+            print(f"Error removing task cgroup {self.path}: {e}")
+            return False
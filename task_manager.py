@@ -2,17 +2,23 @@ from PyQt5.QtWidgets import (
     QMessageBox, QFormLayout, QListWidget, QListWidgetItem, QDateTimeEdit,
     QApplication, QWidget, QDialog, QVBoxLayout, QLabel, QLineEdit, QPushButton,
     QHBoxLayout, QComboBox, QCheckBox, QFileDialog, QProgressDialog, QSizePolicy, QProgressBar, QGridLayout, QSpacerItem,
-    QTableWidget, QTableWidgetItem, QHeaderView, QTextEdit
+    QTableWidget, QTableWidgetItem, QHeaderView, QTextEdit, QPlainTextEdit
 )
 from PyQt5.QtGui import QFont, QImage, QPixmap, QDesktopServices, QColor, QMouseEvent
 from PyQt5.QtCore import pyqtSignal, QDateTime, Qt, QUrl, QTimer
+from qasync import QEventLoop, asyncSlot
 from typing import List
 from database import *
 import sys
 import os
+import socket
+import asyncio
 from datetime import datetime
 from enum import Enum
-from process_monitor import ProcessMonitor
+from process_monitor import ProcessMonitor, ProcessSampler
+from unresponsive_detector import UnresponsiveConfig
+from task_cgroup import TaskCgroupManager, CgroupLimits
+from log_capture import read_log_tail, read_log_since
 import psutil
 from exit_code import *
 
@@ -36,19 +42,31 @@ task_types = {
     8 : "Others",
 }
 
+# parsed json files, {path: (mtime, data)}, a file is parsed again only when its mtime changed
+json_file_cache = {}
+
+def read_json_file(json_file):
+    mtime = os.path.getmtime(json_file)
+    cached = json_file_cache.get(json_file)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with open(json_file, 'r') as file:
+        data = json.load(file)
+    json_file_cache[json_file] = (mtime, data)
+    return data
+
 def read_json_dict(json_file, section):
     try:
-        # Read the JSON file
-        with open(json_file, 'r') as file:
-            data = json.load(file)
+        # Read the JSON file (cached until it is modified)
+        data = read_json_file(json_file)
         
         # Extract the section
-        section = data.get(section, None)
+        section_data = data.get(section, None)
         
-        if section is None:
+        if section_data is None:
             raise KeyError(f"Section '{section}' not found in the JSON file.")
         
-        return section
+        return section_data
     
     except FileNotFoundError:
         print(f"Error: The file {json_file} does not exist.")
@@ -72,6 +90,27 @@ class StatusValue(Enum):
     UNKNOWN = "UNKNOWN"
 
 PROCESS_LOG_DIR = '.process_log'
+PROCESS_LOG_TAIL_BYTES = 64 * 1024 # task details only show the end of the process log
+PROCESS_LOG_MAX_LINES = 5000 # lines kept in the process log view while following it
+PROCESS_LOG_FOLLOW_INTERVAL = 500 # ms, task details append new lines of the process log
+TASK_DATA_REFRESH_INTERVAL = 500 # ms, Ui_TaskManager refresh all task widgets data by one query
+TASK_LIST_REFRESH_INTERVAL = 1000 # ms, Ui_TaskManager get new/deleted tasks
+NOTIFY_FALLBACK_REFRESH_INTERVAL = 10000 # ms, polling interval when task changes are pushed by database notifications
+NOTIFY_APPLY_DELAY = 50 # ms, group notifications come in burst then apply them together
+TASK_WRITE_FLUSH_INTERVAL = 200 # ms, buffered task updates are written together
+ARCHIVE_TASKS_INTERVAL = 3600 * 1000 # ms, move old finished tasks out of avt_task
+
+def get_worker_ip(target_host="8.8.8.8", target_port=80):
+    # ip of the network interface used to reach target (database server), no packet is sent
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.connect((target_host, int(target_port)))
+            return sock.getsockname()[0]
+    except (OSError, ValueError):
+        try:
+            return socket.gethostbyname(socket.gethostname())
+        except OSError:
+            return "127.0.0.1"
 
 def format_timestamp(time : datetime):
     if time is None:
@@ -82,6 +121,13 @@ def format_timestamp(time : datetime):
     except ValueError:
         return "Invalid Timestamp"  # Placeholder string when ValueError occurs
     
+def format_rate(bytes_per_second):
+    for unit in ("B/s", "KB/s", "MB/s"):
+        if bytes_per_second < 1024:
+            return f"{bytes_per_second:.0f} {unit}" if unit == "B/s" else f"{bytes_per_second:.1f} {unit}"
+        bytes_per_second /= 1024
+    return f"{bytes_per_second:.1f} GB/s"
+    
 class CustomTableWidget(QTableWidget):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -108,13 +154,20 @@ class ValueLabel(QLabel):
         self.setStyleSheet("color: #e0e0e0;")  # Example color for values, adjust as needed
         
 class TaskItemDetails(QDialog):
-    def __init__(self, task_data: AvtTask, excute_cmd: str, process_log: str):
+    def __init__(self, task_data: AvtTask, excute_cmd: str, process_log_file_path: str):
         super().__init__()
         self.task = task_data
-        self.process_log = process_log
+        self.process_log_file_path = process_log_file_path
+        self.process_log_position = (None, 0) # (inode, offset) of the end of the process log already shown
         self.excute_cmd = excute_cmd
         self.setMinimumWidth(640)
         self.initUI()
+        
+        # follow the process log like tail -f while the dialog is open
+        self.process_log_timer = QTimer(self)
+        self.process_log_timer.timeout.connect(self.follow_process_log)
+        self.process_log_timer.start(PROCESS_LOG_FOLLOW_INTERVAL)
+        self.finished.connect(self.process_log_timer.stop)
 
     def initUI(self):
         form_layout = QFormLayout()
@@ -168,11 +221,14 @@ class TaskItemDetails(QDialog):
         form_layout.addRow(HeaderLabel("Command:"), ValueLabel(self.excute_cmd))
         
         # Process Log
-        process_log_text = QTextEdit()
-        process_log_text.setReadOnly(True)
-        process_log_text.setPlainText(self.process_log)
-        self.setupTextEdit(process_log_text, value_font)
-        form_layout.addRow(HeaderLabel("Process Log:"), process_log_text)
+        # only the tail of the log is read, the log can be large
+        self.process_log_text = QPlainTextEdit()
+        self.process_log_text.setReadOnly(True)
+        self.process_log_text.setMaximumBlockCount(PROCESS_LOG_MAX_LINES)
+        process_log, self.process_log_position = read_log_tail(self.process_log_file_path, PROCESS_LOG_TAIL_BYTES)
+        self.process_log_text.setPlainText(process_log)
+        self.setupTextEdit(self.process_log_text, value_font)
+        form_layout.addRow(HeaderLabel("Process Log:"), self.process_log_text)
 
         # Set layout and title
         layout = QVBoxLayout()
@@ -184,17 +240,32 @@ class TaskItemDetails(QDialog):
         text_edit.setStyleSheet(f"color: white; font: {font.family()}, {font.pointSize()}pt;")
         # text_edit.setFixedHeight(min(text_edit.document().size().height() + 10, 200))  # Set maximum height and adjust dynamically
         text_edit.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+    
+    def follow_process_log(self):
+        process_log, self.process_log_position = read_log_since(self.process_log_file_path, self.process_log_position, PROCESS_LOG_TAIL_BYTES)
+        if process_log == "":
+            return
+        scroll_bar = self.process_log_text.verticalScrollBar()
+        at_bottom = scroll_bar.value() == scroll_bar.maximum()
+        cursor = self.process_log_text.textCursor()
+        cursor.movePosition(cursor.End)
+        cursor.insertText(process_log)
+        if at_bottom: # keep following the end unless the user scrolled up
+            scroll_bar.setValue(scroll_bar.maximum())
         
 
 class TaskItem(QWidget):
     signal_status_changed = pyqtSignal()
     
-    def __init__(self, task_id: int, db_connection: Database):
+    def __init__(self, task_id: int, db_connection: Database, async_db_connection: AsyncDatabase, task_data: TaskRow = None):
         super().__init__()
         self.task_id = task_id
         self.db = db_connection
+        self.async_db = async_db_connection
 
-        self.task = self.db.get_task_by_id(self.task_id)
+        # use task data already fetched by caller if any, avoid one more query per widget
+        # task data is TaskRow (no task_param/task_output), full task is only loaded for task details
+        self.task = task_data if task_data is not None else self.db.get_tasks_by_ids([self.task_id]).get(self.task_id)
         self.process_log_file_path = os.path.join(PROCESS_LOG_DIR, f"{self.task.id}.log")
         self.onTable = True # temporary set for fix display task statistics
         self.moduleStarted = False
@@ -245,6 +316,16 @@ class TaskItem(QWidget):
         self.ram_usage_progess.setValue(ram_usage_mb)
         self.ram_usage_progess.setFormat(f"{ram_usage_mb} MB")
         
+        # disk io: storage read/write, all io: every read/write syscall (network, pipes, disk cache)
+        self.disk_io_value = ValueLabel("R 0 B/s - W 0 B/s")
+        self.disk_io_value.setAlignment(Qt.AlignCenter)
+        self.all_io_value = ValueLabel("R 0 B/s - W 0 B/s")
+        self.all_io_value.setAlignment(Qt.AlignCenter)
+        self.handles_value = ValueLabel("0 / 0") # open fds / threads
+        self.handles_value.setAlignment(Qt.AlignCenter)
+        self.fds = 0
+        self.threads = 0
+        
         self.time_excute_header = HeaderLabel("Thực thi:")
         self.time_excute_value = ValueLabel("0s")
         self.time_excute_value.setAlignment(Qt.AlignCenter)
@@ -309,54 +390,39 @@ class TaskItem(QWidget):
         self.view_task_detail_button.clicked.connect(self.view_task_detail)
         
         self.command = ""
+        self.process_monitor = None
         
-        # Note: Really carefully consider to use auto update data from database
-        # Maybe need an auto update because some time module can change task data in database (or user changes)
-        # It make program take more resource and more request to the database but we can make sure the data always updated
-        # Solution: Only update task data when process is running
-        self.non_update_task_stat_counter = 0
-        self.auto_update_task_data_interval = 500 # auto update task form db every 3s
-        self.auto_update_task_data_timer = QTimer(self)
-        self.auto_update_task_data_timer.timeout.connect(self.auto_update_task_data_from_db)
-        self.auto_update_task_data_timer.start(self.auto_update_task_data_interval) # auto update data every 3s
-    
-    def view_task_detail(self):
-        process_log = ""
-        try:
-            with open(self.process_log_file_path, 'r') as file:
-                process_log = file.read()
-        except FileNotFoundError:
-            process_log = ""
-        self.update_task_data_from_db()
-        dialog = TaskItemDetails(self.task, self.command, process_log)
+        # Task data is auto updated from database by Ui_TaskManager (one query for all task widgets)
+        # because module can change task data in database (or user changes)
+        # see Ui_TaskManager.refresh_task_widgets_data and auto_update_task_data
+        self.task_detail_dialog = None
+    
+    @asyncSlot()
+    async def view_task_detail(self):
+        await self.update_task_data_from_db(full=True)
+        dialog = TaskItemDetails(self.task, self.command, self.process_log_file_path)
         
         dialog.setParent(self.parent())
-        dialog.exec()
-    
-    def increase_waiting_queue_position(self):
-        self.update_task_data_from_db()
-        if self.task.task_stat <= -2:
-            self.db.update_task(self.task.id, task_stat=self.task.task_stat + 1)
-            self.task.task_stat += 1
+        # open() instead of exec(), a nested event loop must not run inside the asyncio task
+        self.task_detail_dialog = dialog
+        dialog.open()
     
-    def auto_update_task_data_from_db(self):
+    def auto_update_task_data(self, task_data: TaskRow):
+        # called periodically by Ui_TaskManager with task data fetched in bulk
+        # also for a running task out of the table, only to keep its heartbeat
+        old_task = self.task
+        
+        self.task = task_data
+        
+        # task updated by its module (running time, ETA,...) is a heartbeat for the unresponsive detector
+        # the detector decides with the process activity, a task is not killed only because it does not update
+        if self.task.task_stat != old_task.task_stat or self.task.updated_at != old_task.updated_at:
+            self.process_monitor.record_heartbeat()
+        
         if not self.onTable:
             return
-    
-        old_task_stat = self.task.task_stat
-        
-        self.task = self.db.get_task_by_id(self.task.id)
         new_task_status = self.get_status_by_stat(self.task.task_stat) # it will ignore killed status
         
-        # if task started but dont update task stat (running time) for 20, consider as non-responding
-        if self.task.task_stat == old_task_stat and old_task_stat > 1:
-            self.non_update_task_stat_counter += 1
-            print(f"Non responding counter: {self.non_update_task_stat_counter} - PID: {self.process_monitor.pid}")
-            if self.non_update_task_stat_counter*(self.auto_update_task_data_interval/1000) > 20:
-                self.process_monitor.signal_process_not_responding.emit()
-        else:
-            self.non_update_task_stat_counter = 0
-        
         # update status display
         if self.status != new_task_status and self.status != StatusValue.KILLED:
             self.update_task_status(new_task_status)
@@ -370,10 +436,21 @@ class TaskItem(QWidget):
         if self.task.task_stat > 1:
             self.time_excute_value.setText(f"{self.task.task_stat}s")
         
-    def update_task_data_from_db(self):
+    def is_process_running(self):
+        # process started by this widget and still monitored, whether the task is on the table or not
+        return self.process_monitor is not None and self.process_monitor.monitoring
+    
+    async def update_task_data_from_db(self, full=False):
+        # full: load all columns (task_param, task_output) for task details, else load TaskRow
         if not self.onTable:
             return
-        self.task = self.db.get_task_by_id(self.task.id)
+        if full:
+            task = await self.async_db.get_task_by_id(self.task.id)
+        else:
+            task = (await self.async_db.get_tasks_by_ids([self.task.id])).get(self.task.id)
+        if task is None:
+            return
+        self.task = task
         new_task_status = self.get_status_by_stat(self.task.task_stat) # it will ignore killed status
         
         # update status display
@@ -384,15 +461,20 @@ class TaskItem(QWidget):
         self.update_at_value.setText(format_timestamp(self.task.updated_at))
         self.time_remain_value.setText(f"{str(self.task.task_eta)}s") # maybe module udpate ETA while processing
         
-    def update_task_command(self, command):
+    def update_task_command(self, command, unresponsive_config: UnresponsiveConfig = None,
+                            cgroup_manager: TaskCgroupManager = None, cgroup_limits: CgroupLimits = None):
         self.command = command
-        self.process_monitor = ProcessMonitor(command)
+        self.process_monitor = ProcessMonitor(command, unresponsive_config=unresponsive_config, cgroup_manager=cgroup_manager,
+                                              cgroup_limits=cgroup_limits, cgroup_name=f"task_{self.task.id}")
         self.process_monitor.signal_process_started.connect(self.process_started)
         self.process_monitor.signal_process_ended.connect(self.process_ended)
         self.process_monitor.signal_process_killed.connect(self.process_killed)
         self.process_monitor.signal_running_time_update.connect(self.update_running_time)
         self.process_monitor.signal_process_cpu_usage_update.connect(self.update_cpu_usage)
         self.process_monitor.signal_process_ram_usage_update.connect(self.update_ram_usage)
+        self.process_monitor.signal_process_io_usage_update.connect(self.update_io_usage)
+        self.process_monitor.signal_process_fds_update.connect(self.update_fds)
+        self.process_monitor.signal_process_threads_update.connect(self.update_threads)
         self.process_monitor.signal_process_not_responding.connect(self.process_non_responding)
     
     def update_running_time(self, value):
@@ -403,50 +485,50 @@ class TaskItem(QWidget):
         self.time_excute_value.setText(f"{value}s")
         # update running time in task stat
         if value > 1: # only update running time > 1 in task_stat to avoid confilict with tast_stat=1 (finished) or task_stat = 0 (error)
-            self.db.update_task(self.task.id, task_stat=value)
+            self.db.queue_task_update(self.task.id, task_stat=value)
             self.task.task_stat = value
         
-    def process_killed(self):
+    @asyncSlot()
+    async def process_killed(self):
         # update stats to database
-        if not self.db.update_task(self.task.id, task_stat=0, task_message=exit_code_messages[EXIT_PROCESS_KILLED_BY_WTM]):
+        # terminal status, written immediately after buffered updates of this task
+        if not await self.async_db.queue_task_update(self.task.id, task_stat=0, task_message=exit_code_messages[EXIT_PROCESS_KILLED_BY_WTM]):
             print(f"Warning: Process killed but cannot update status to database - pid: {self.task.id}")
         # Special update process KILLED status (because in db we set 0 value for killed/error) 
         self.task.task_stat = 0
         self.update_task_status(StatusValue.KILLED)
-        self.update_task_data_from_db()
+        await self.update_task_data_from_db()
     
-    def process_non_responding(self):
+    def process_non_responding(self, reason):
         # print(f"Process {self.command} is not responding..")
         # TODO: Hanle not-responding, ask user for kill this process or auto kill
         self.status_label.setText("NOT RESPONDING")
+        self.status_label.setToolTip(reason)
         self.status_label.setStyleSheet(f"font-size: 10pt; font-weight: bold; color: {status_colors[StatusValue.ERROR.value].name()};")
-        print("Kill non-responding process: ", self.task.process_id)
+        print(f"Kill non-responding process: {self.task.process_id} - {reason}")
         self.kill_process()
     
-    def process_ended(self, exit_code):
+    @asyncSlot(int)
+    async def process_ended(self, exit_code):
         print(f"Process of task {self.task.id} end with exit code: {exit_code}")
-        # get task data when process ended
-        current_task_data = self.db.get_task_by_id(self.task.id)
         
         # if task stat not updated by module, WTM update it and message by exit code
+        # checked and written by one conditional update, no need to get task data before
         # Note: Module should only update task stat for finished or error status
-        if current_task_data.task_stat != 0 and current_task_data.task_stat != 1: 
-            if exit_code == 0:
-                if not self.db.update_task(self.task.id, task_stat=1, task_message=exit_code_messages[exit_code]):
-                    print(f"Warning: Process ended but cannot update status to database - TaskID: {self.task.id}")
-                
-            else: # exit code != 0 mean process not finished
-                if not self.db.update_task(self.task.id, task_stat=0, task_message=exit_code_messages.get(exit_code, f"Unknown error with code {exit_code}")):
-                    print(f"Warning: Process ended but cannot update status to database - TaskID: {self.task.id}")
+        await self.async_db.flush_task_updates() # write buffered updates first, keep write order
+        if exit_code == 0:
+            await self.async_db.update_unfinished_task(self.task.id, task_stat=1, task_message=exit_code_messages[exit_code])
+        else: # exit code != 0 mean process not finished
+            await self.async_db.update_unfinished_task(self.task.id, task_stat=0, task_message=exit_code_messages.get(exit_code, f"Unknown error with code {exit_code}"))
                 
         # update all task data when process ended (stat, output, message,...)
-        self.update_task_data_from_db()
+        await self.update_task_data_from_db()
 
     
     def process_started(self, pid):
         self.task.process_id = pid
         # set stats to database
-        if not self.db.update_task(self.task.id, process_id=pid):
+        if not self.db.queue_task_update(self.task.id, process_id=pid):
             print(f"Warning: Process started but cannot update status to database - pid: {self.task.id}")
         # update status
         self.update_task_status(StatusValue.RUNNING)
@@ -459,6 +541,21 @@ class TaskItem(QWidget):
     
     def update_cpu_usage(self, usage):
         self.cpu_usage_progess.setValue(int(usage))   
+    
+    def update_io_usage(self, io_usage):
+        self.disk_io_value.setText(f"R {format_rate(io_usage['read_bytes_rate'])} - W {format_rate(io_usage['write_bytes_rate'])}")
+        self.disk_io_value.setToolTip(f"Disk read: {io_usage['read_bytes'] / (1024 * 1024):.1f} MB - write: {io_usage['write_bytes'] / (1024 * 1024):.1f} MB")
+        self.all_io_value.setText(f"R {format_rate(io_usage['read_chars_rate'])} - W {format_rate(io_usage['write_chars_rate'])}")
+        self.all_io_value.setToolTip(f"All reads (network, pipes, disk cache): {io_usage['read_chars'] / (1024 * 1024):.1f} MB - "
+                                     f"writes: {io_usage['write_chars'] / (1024 * 1024):.1f} MB")
+    
+    def update_fds(self, fds):
+        self.fds = fds
+        self.handles_value.setText(f"{self.fds} / {self.threads}")
+    
+    def update_threads(self, threads):
+        self.threads = threads
+        self.handles_value.setText(f"{self.fds} / {self.threads}")
              
     def get_status_by_stat(self, stat) -> StatusValue:
         if stat < 0:
@@ -516,12 +613,25 @@ class Ui_TaskManager(QWidget):
         super().__init__()
         self.config_file = config_file
         self.task_limit = 100
+        self.task_window_size = self.task_limit # number of newest tasks displayed, increased by load older tasks
         db_config = DatabaseConfig().read_from_json(self.config_file)
-        self.db = Database(db_config.host, db_config.port, db_config.user, db_config.password, db_config.database)
+        self.db = Database(db_config.host, db_config.port, db_config.user, db_config.password, db_config.database,
+                           **db_config.get_pool_options())
+        self.worker_ip = get_worker_ip(db_config.host, db_config.port)
         
         if not self.db.connected:
             QMessageBox.warning(self, "Lỗi", "Không thể kết nối đến cơ sở dữ liệu, vui lòng kiểm tra lại file cấu hình!")
             sys.exit(EXIT_CANNOT_CONNECT_TO_DATABASE)
+        
+        if db_config.ensure_indexes:
+            self.db.ensure_indexes()
+        self.db.check_query_plans() # warn if hot task queries scan the whole table
+        
+        # status/message writes from task widgets are buffered and written together
+        self.db.start_write_buffer(TASK_WRITE_FLUSH_INTERVAL)
+        # periodic/event queries are awaited on the Qt asyncio loop (qasync), they never block painting
+        self.async_db = AsyncDatabase(self.db)
+        self.running_async_jobs = set()
 
         self.main_layout = QVBoxLayout()
         self.top_layout = QHBoxLayout()
@@ -529,7 +639,7 @@ class Ui_TaskManager(QWidget):
         self.info_layout = QVBoxLayout()
         self.machine_stats_layout = QVBoxLayout()
         self.table_widget = QTableWidget()
-        self.cols = ["Trạng thái", "Khởi tạo", "Cập nhật", "Người tạo", "Type", "CPU Usage", "RAM Usage", "Thực thi", "ETA", "", "", ""]
+        self.cols = ["Trạng thái", "Khởi tạo", "Cập nhật", "Người tạo", "Type", "CPU Usage", "RAM Usage", "Disk I/O", "All I/O", "FDs / Threads", "Thực thi", "ETA", "", "", ""]
         self.table_widget.setColumnCount(len(self.cols))  # Number of columns to display
         self.table_widget.setHorizontalHeaderLabels(self.cols)
         self.table_widget.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
@@ -557,12 +667,20 @@ class Ui_TaskManager(QWidget):
         self.num_task_layout.addRow(self.num_running_header, self.num_running_value)
         self.num_task_layout.addRow(self.num_finished_header, self.num_finished_value)
         self.num_task_layout.addRow(self.num_error_header, self.num_error_value)
+        self.db_pool_header = HeaderLabel("DB POOL")
+        self.db_pool_header.setStyleSheet(f"font-size: 14pt; font-weight: bold; color: white;")
+        self.db_pool_value = QLabel("")
+        self.db_pool_value.setStyleSheet(f"font-size: 11pt; color: white;")
+        self.num_task_layout.addRow(self.db_pool_header, self.db_pool_value)
         spacer = QSpacerItem(20, 20, QSizePolicy.Maximum, QSizePolicy.Maximum)
         self.num_task_layout.addItem(spacer)
         self.auto_serve_task_checkbox = QCheckBox("Auto-serve task")
         self.auto_serve_task_checkbox.stateChanged.connect(self.auto_serve_task_state_change)
         self.auto_serve_task_checkbox.setStyleSheet(f"font-size: 14pt; font-weight: bold; color: white;")
         self.num_task_layout.addRow(self.auto_serve_task_checkbox, QLabel(""))
+        self.load_older_tasks_button = QPushButton("Load older tasks")
+        self.load_older_tasks_button.clicked.connect(self.load_older_tasks)
+        self.num_task_layout.addRow(self.load_older_tasks_button, QLabel(""))
         self.num_task_layout.setSpacing(10)
         
         self.num_task_widget = QWidget()
@@ -592,12 +710,21 @@ class Ui_TaskManager(QWidget):
         if self.command_dict is None:
             QMessageBox.warning(self, "Error read module command", f"No section \"modules\" in {self.config_file} file, need to define it to call module for task processing")
             sys.exit(1)
+        
+        # optional cgroup v2 mode, each task runs in its own cgroup with limits of its type
+        # falls back to plain processes when cgroup v2 is not delegated
+        self.cgroup_config = read_json_file(self.config_file).get("cgroup", {})
+        self.cgroup_manager = None
+        if self.cgroup_config.get("enabled", False):
+            self.cgroup_manager = TaskCgroupManager.setup(self.cgroup_config.get("parent"), self.cgroup_config.get("move_to_leaf", False))
 
-        self.list_task = self.db.get_tasks(limit=self.task_limit)
+        # take watermark before loading tasks, tasks added while loading will come in the first change feed
+        self.task_watermark = self.db.get_task_watermark()
+        self.list_task = self.db.get_task_rows(limit=self.task_limit)
         self.list_task_widget = []
         
         for index, task in enumerate(self.list_task):
-            task_widget = TaskItem(task.id, self.db)
+            task_widget = TaskItem(task.id, self.db, self.async_db, task)
             self.add_task_widget(task_widget, index)
         
         self.adjust_column_widths()
@@ -605,14 +732,118 @@ class Ui_TaskManager(QWidget):
         
         # realtime update task in database
         self.update_task_from_db_timer = QTimer(self)
-        self.update_task_from_db_timer.timeout.connect(self.update_list_task_from_db)
-        self.update_task_from_db_timer.start(1000)
+        self.update_task_from_db_timer.timeout.connect(lambda: self.start_async_job(self.update_list_task_from_db))
+        self.update_task_from_db_timer.start(TASK_LIST_REFRESH_INTERVAL)
+        
+        # realtime update data of all task widgets, one query per tick for all displaying tasks
+        self.refresh_task_widgets_data_timer = QTimer(self)
+        self.refresh_task_widgets_data_timer.timeout.connect(lambda: self.start_async_job(self.refresh_task_widgets_data))
+        self.refresh_task_widgets_data_timer.start(TASK_DATA_REFRESH_INTERVAL)
         
         # # Currently start task by manual
         # # auto start process by process queue
         self.auto_serve_waiting_tasks_timer = QTimer(self)
-        self.auto_serve_waiting_tasks_timer.timeout.connect(self.serve_waiting_tasks)  
+        self.auto_serve_waiting_tasks_timer.timeout.connect(lambda: self.start_async_job(self.serve_waiting_tasks))
         # self.auto_serve_waiting_tasks_timer.start(2000)
+        
+        # display connection pool usage (no query, read from pool counters)
+        self.update_db_pool_stats_timer = QTimer(self)
+        self.update_db_pool_stats_timer.timeout.connect(self.update_db_pool_stats)
+        self.update_db_pool_stats_timer.start(1000)
+        
+        # keep live task table small, archive old finished/error tasks
+        self.archive_after_days = db_config.archive_after_days
+        self.archive_tasks_timer = QTimer(self)
+        self.archive_tasks_timer.timeout.connect(lambda: self.start_async_job(self.archive_finished_tasks))
+        if self.archive_after_days is not None:
+            self.archive_tasks_timer.start(ARCHIVE_TASKS_INTERVAL)
+            self.start_async_job(self.archive_finished_tasks)
+        
+        # optional periodic dump of per operation query latency, to compare versions and size the database
+        self.query_stats_file = db_config.query_stats_file
+        if db_config.query_stats_interval:
+            self.db.start_query_stats_dump(db_config.query_stats_interval, self.query_stats_file)
+        
+        # optional push mode: database notify task changes, polling is kept as slow fallback
+        self.task_notification_listener = None
+        self.notified_task_ids = set()
+        self.notified_new_task = False
+        if db_config.use_notify:
+            self.start_task_notification_listener()
+    
+    def start_task_notification_listener(self):
+        if not self.db.install_task_notify_trigger():
+            print("Cannot install task notify trigger, keep polling task changes")
+            return
+        
+        self.task_notification_listener = self.db.create_task_notification_listener()
+        self.task_notification_listener.signal_task_notified.connect(self.task_notified)
+        self.task_notification_listener.signal_task_config_changed.connect(self.db.invalidate_task_config_cache)
+        self.task_notification_listener.signal_listener_failed.connect(self.task_notification_listener_failed)
+        self.task_notification_listener.start()
+        
+        self.update_task_from_db_timer.setInterval(NOTIFY_FALLBACK_REFRESH_INTERVAL)
+        self.refresh_task_widgets_data_timer.setInterval(NOTIFY_FALLBACK_REFRESH_INTERVAL)
+    
+    def task_notification_listener_failed(self, error):
+        print(f"Task notification listener failed, fall back to polling: {error}")
+        self.task_notification_listener = None
+        self.update_task_from_db_timer.setInterval(TASK_LIST_REFRESH_INTERVAL)
+        self.refresh_task_widgets_data_timer.setInterval(TASK_DATA_REFRESH_INTERVAL)
+    
+    def task_notified(self, task_id, operation):
+        # notifications come in burst (module update, queue update), collect them and apply later together
+        if not self.notified_task_ids and not self.notified_new_task:
+            QTimer.singleShot(NOTIFY_APPLY_DELAY, lambda: self.start_async_job(self.apply_task_notifications, skip_if_running=False))
+        
+        if operation == "UPDATE":
+            self.notified_task_ids.add(task_id)
+        else: # INSERT/DELETE, task list changed
+            self.notified_new_task = True
+    
+    async def apply_task_notifications(self):
+        notified_task_ids, self.notified_task_ids = self.notified_task_ids, set()
+        notified_new_task, self.notified_new_task = self.notified_new_task, False
+        
+        displaying_task_ids = {task.id for task in self.list_task}
+        if notified_new_task or not notified_task_ids.issubset(displaying_task_ids):
+            await self.update_list_task_from_db()
+        
+        if notified_task_ids:
+            await self.refresh_task_widgets_data(notified_task_ids)
+        
+        # new task come, serve it now instead of waiting for next auto-serve tick
+        if notified_new_task and self.auto_serve_waiting_tasks_timer.isActive():
+            self.start_async_job(self.serve_waiting_tasks)
+    
+    async def archive_finished_tasks(self):
+        result = await self.async_db.archive_finished_tasks(self.archive_after_days)
+        print(f"Archive finished tasks: {result['moved']} rows moved ({result['rows_per_second']:.0f} rows/s)")
+    
+    def start_async_job(self, job, *args, skip_if_running=True):
+        # run coroutine function job on the Qt asyncio loop
+        # skip if previous run of this job is not finished yet, so slow queries never pile up
+        if skip_if_running and job in self.running_async_jobs:
+            return
+        self.running_async_jobs.add(job)
+        future = asyncio.ensure_future(job(*args))
+        future.add_done_callback(lambda future: self.async_job_done(job, future))
+    
+    def async_job_done(self, job, future):
+        self.running_async_jobs.discard(job)
+        if not future.cancelled() and future.exception() is not None:
+            print(f"Error in {job.__name__}: {future.exception()}")
+    
+    def closeEvent(self, event):
+        if self.task_notification_listener is not None:
+            self.task_notification_listener.stop()
+        self.db.stop_write_buffer()
+        self.async_db.shutdown()
+        ProcessSampler.shutdown()
+        self.db.stop_query_stats_dump()
+        if self.query_stats_file is not None:
+            self.db.dump_query_stats(self.query_stats_file) # final totals of this run
+        super().closeEvent(event)
     
     def auto_serve_task_state_change(self):
         if self.auto_serve_task_checkbox.isChecked():
@@ -623,39 +854,41 @@ class Ui_TaskManager(QWidget):
         else:
             self.auto_serve_waiting_tasks_timer.stop()
     
-    def serve_waiting_tasks(self):
-        need_to_update_queue = True
+    async def serve_waiting_tasks(self):
+        # TODO: Check current resource and decide to serve this task
+        # We need to consider usage resoure by task type, difference of each task
+        # It's to hard and need mode research for good policy of serve task
+        # ex: simple check if current CPU and RAM usage is less then 80%
+        if self.current_system_cpu_percent > 60 or self.current_system_ram_percent > 60:
+            print("=========== IGNORE SERVER TASK BECAUSE OF LESS RESOURCE ===========")
+            return
         
-        for task_widget in self.list_task_widget:
-            if task_widget.task.task_stat == -1: # serve task that in first queue
-                
-                # if have task with stat = -1 dont update queue if this task not served
-                need_to_update_queue = False
-                
-                serve_this_task = True
-                # TODO: Check current resource and decide to serve this task
-                # We need to consider usage resoure by task type, difference of each task
-                # It's to hard and need mode research for good policy of serve task
-                # ex: simple check if current CPU and RAM usage is less then 80%
-                if self.current_system_cpu_percent > 60 or self.current_system_ram_percent > 60:
-                    print("=========== IGNORE SERVER TASK BECAUSE OF LESS RESOURCE ===========")
-                    serve_this_task = False
-                
-                # If serve a task, need to update queue
-                if serve_this_task:
-                    print(f"Serve task with id: {task_widget.task.id} - Name: {task_widget.task.creator}")
-                    task_widget.start_process()
-                    need_to_update_queue = True
-                    # only serve one task when call serve_waiting_tasks function 
-                    # it prevent serve case that server multi task at the same time, can cause machine overload
-                    break  
-        
-        # if this task was served, increase others queue
-        if need_to_update_queue:
-            print("Updating queue...")
-            for task_widget in self.list_task_widget:
-                task_widget.increase_waiting_queue_position()
+        # claim task in first queue in database, so a task is never served by two worker nodes
+        # only serve one task when call serve_waiting_tasks function 
+        # it prevent serve case that server multi task at the same time, can cause machine overload
+        # task types disabled in avt_task_config are not served, configs come from the cache
+        task_types = [int(task_type) for task_type in self.get_module_command_dict().keys()]
+        task_types = await self.async_db.get_enabled_task_types(task_types)
+        if not task_types:
+            return
+        task_id = await self.async_db.claim_next_task(self.worker_ip, task_types)
+        if task_id is None:
+            return
+        
+        task_widget = self.get_task_widget(task_id)
+        if task_widget is None: # claimed task is not displayed (yet)
+            task = await self.async_db.get_task_by_id(task_id)
+            if task is None:
+                print(f"Warning: Claimed task not found - TaskID: {task_id}")
+                return
+            task_widget = self.add_task_to_list(task)
         
+        print(f"Serve task with id: {task_widget.task.id} - Name: {task_widget.task.creator}")
+        task_widget.start_process()
+    
+    def get_task_widget(self, task_id):
+        return next((task_widget for task_widget in self.list_task_widget 
+                     if task_widget.task_id == task_id and task_widget.onTable), None)
         
     def update_current_system_ram(self, value):
         self.current_system_ram_percent = value
@@ -664,90 +897,132 @@ class Ui_TaskManager(QWidget):
         self.current_system_cpu_percent = value
     
     def add_task_widget(self, task_widget: TaskItem, index=-1): # default to end of list
-        command = self.command_dict.get(str(int(task_widget.task.task_type)), "")
+        command = self.get_module_command_dict().get(str(int(task_widget.task.task_type)), "")
         full_command = f"{command} --avt_task_id {task_widget.task.id} --config_file {self.config_file}" 
         # print("Set task command: ", full_command)
-        task_widget.update_task_command(full_command)
+        task_type = int(task_widget.task.task_type)
+        task_widget.update_task_command(full_command, self.get_unresponsive_config(task_type), self.cgroup_manager, self.get_cgroup_limits(task_type))
         # connect signal slot for task changed here
         task_widget.signal_status_changed.connect(self.update_task_statictics)
         
         self.list_task_widget.insert(index, task_widget)        
         
-    def update_list_task_from_db(self):
-        new_task_list = self.db.get_tasks(limit=self.task_limit)
+    async def update_list_task_from_db(self):
+        # apply only new and deleted tasks since last seen watermark instead of reloading the whole list
+        new_tasks, deleted_ids, self.task_watermark = await self.async_db.get_changes_since(
+            self.task_watermark, known_ids=[task.id for task in self.list_task])
         
-        # Create sets for comparison
         current_task_ids = {task.id for task in self.list_task}
-        new_task_ids = {task.id for task in new_task_list}
-        
-        # Tasks to add
-        tasks_to_add = [task for task in new_task_list if task.id not in current_task_ids]
-        
-        # Tasks to remove
-        tasks_to_remove = [task for task in self.list_task if task.id not in new_task_ids]
         
-        # if len(tasks_to_remove) > 0:
-        #     print("Removing task" , [task.id for task in tasks_to_remove])
-        #     print("List task id: ", [task.id for task in self.list_task])
-        #     print("List task widget id: ", [task.task.id for task in self.list_task_widget])
-        
-        # Remove tasks
-        for task in tasks_to_remove:
-            index = self.list_task.index(task)
-            print("index to remove: ", index)
-            self.table_widget.removeRow(index)
-            self.list_task.remove(task)
-            
-            self.list_task_widget[index].onTable = False
-            # savely remove task widget
-            # got crash when removed widget 
-            # TODO: got crash here, need to remove widget to free ram usage, 
-            # task_widget size is 136 bytes, calculate size of array 10000 task is ~1.3MB
-            # self.list_task_widget = [widget for widget in self.list_task_widget if widget.task.id != task.id]
-            # self.list_task_widget.remove(index)
-            # print("List task id: ", [task.id for task in self.list_task])
-            # print("List task widget id: ", [task.task.id for task in self.list_task_widget])
+        # Tasks to add: new tasks which belong to the newest task_window_size tasks
+        # tasks already in the list are updated by refresh_task_widgets_data
+        oldest_created_at = self.list_task[-1].created_at if len(self.list_task) >= self.task_window_size else None
+        tasks_to_add = [task for task in new_tasks 
+                        if task.id not in current_task_ids and (oldest_created_at is None or task.created_at > oldest_created_at)]
+        tasks_to_add.sort(key=lambda task: task.created_at)
         
+        # Tasks to remove: deleted in database
+        for task_id in deleted_ids:
+            self.remove_task_from_list(task_id)
 
         # Add new tasks to the beginning of the table and lists
-        for task in reversed(tasks_to_add):  # Reverse to add to the top
-            self.list_task.insert(0, task)
-            task_widget = TaskItem(task.id, self.db)  # Assuming TaskItem is correctly defined
-            # self.list_task_widget.insert(0, task_widget)
-            self.add_task_widget(task_widget, 0)
-            self.add_task_to_table(task_widget, self.list_task.index(task))  # Add to the top (row 0)
+        for task in tasks_to_add:  # oldest first, newest end up on the top
+            self.add_task_to_list(task)
         
+        # Tasks to remove: out of newest task_window_size tasks
+        while len(self.list_task) > self.task_window_size:
+            self.remove_task_from_list(self.list_task[-1].id)
+        
+        if tasks_to_add or deleted_ids:
+            self.update_task_statictics()
+    
+    @asyncSlot()
+    async def load_older_tasks(self):
+        # next page of history after the last displayed task (keyset pagination, no re-scan of displayed tasks)
+        self.load_older_tasks_button.setEnabled(False)
+        before = Database.get_task_cursor(self.list_task[-1]) if self.list_task else None
+        older_tasks = await self.async_db.get_task_rows(limit=self.task_limit, before=before)
+        
+        current_task_ids = {task.id for task in self.list_task}
+        for task in older_tasks:
+            if task.id in current_task_ids:
+                continue
+            row = len(self.list_task)
+            self.list_task.append(task)
+            task_widget = TaskItem(task.id, self.db, self.async_db, task)
+            self.add_task_widget(task_widget, len(self.list_task_widget))
+            self.add_task_to_table(task_widget, row)
+        self.task_window_size = max(self.task_window_size, len(self.list_task))
         
         self.update_task_statictics()
+        self.load_older_tasks_button.setEnabled(len(older_tasks) == self.task_limit) # no more older tasks
+    
+    def add_task_to_list(self, task):
+        # add task to the beginning of the table and lists
+        self.list_task.insert(0, task)
+        task_widget = TaskItem(task.id, self.db, self.async_db, task)
+        self.add_task_widget(task_widget, 0)
+        self.add_task_to_table(task_widget, 0)  # Add to the top (row 0)
+        return task_widget
+    
+    def remove_task_from_list(self, task_id):
+        index = next((i for i, task in enumerate(self.list_task) if task.id == task_id), None)
+        if index is None:
+            return
+        print("index to remove: ", index)
+        self.table_widget.removeRow(index)
+        del self.list_task[index]
+        
+        task_widget = self.get_task_widget(task_id)
+        if task_widget is not None:
+            task_widget.onTable = False
+        # savely remove task widget
+        # got crash when removed widget 
+        # TODO: got crash here, need to remove widget to free ram usage, 
+        # task_widget size is 136 bytes, calculate size of array 10000 task is ~1.3MB
+    
+    async def refresh_task_widgets_data(self, task_ids=None):
+        # fetch data of all displaying tasks (or only task_ids) in one query then dispatch to task widgets
+        # running tasks pushed out of the table are refreshed too, their module updates are heartbeats
+        task_widgets = [task_widget for task_widget in self.list_task_widget 
+                        if (task_widget.onTable or task_widget.is_process_running()) and (task_ids is None or task_widget.task_id in task_ids)]
+        if not task_widgets:
+            return
         
-        # Update task data
-        # tasks_to_update = [task for task in new_task_list if task.id in current_task_ids]
-        # Dont need to update existing tasks, 
-        # task_widget object have it own connection to the database and update itself
+        tasks = await self.async_db.get_tasks_by_ids([task_widget.task_id for task_widget in task_widgets])
+        for task_widget in task_widgets:
+            task = tasks.get(task_widget.task_id)
+            if task is not None:
+                task_widget.auto_update_task_data(task)
     
-    def read_module_command_dict(self, config_file, section):
+    def get_unresponsive_config(self, task_type):
+        # thresholds of the unresponsive detector for a task type, optional section "unresponsive" of config file
         try:
-            # Read the JSON file
-            with open(config_file, 'r') as file:
-                data = json.load(file)
-            
-            # Extract the section
-            section = data.get(section, None)
-            
-            if section is None:
-                raise KeyError(f"Section '{section}' not found in the JSON file.")
-            
-            return section
-        
-        except FileNotFoundError:
-            print(f"Error: The file {config_file} does not exist.")
-            return None
-        except json.JSONDecodeError:
-            print("Error: The file is not a valid JSON.")
-            return None
-        except Exception as e:
-            print(f"An error occurred: {e}")
+            section = read_json_file(self.config_file).get("unresponsive", {})
+            return UnresponsiveConfig.from_dict(section, int(task_type))
+        except (OSError, ValueError, TypeError) as e:
+            print(f"Error reading unresponsive config, use default thresholds: {e}")
+            return UnresponsiveConfig()
+    
+    def get_cgroup_limits(self, task_type):
+        # cgroup limits of a task type, None if cgroup mode is off
+        if self.cgroup_manager is None:
             return None
+        try:
+            return CgroupLimits.from_dict(self.cgroup_config, task_type)
+        except TypeError as e:
+            print(f"Error reading cgroup limits, run task without limits: {e}")
+            return CgroupLimits()
+    
+    def read_module_command_dict(self, config_file, section):
+        return read_json_dict(config_file, section)
+    
+    def get_module_command_dict(self):
+        # re-read only when the config file was modified, keep last good commands on error
+        command_dict = read_json_dict(self.config_file, "modules")
+        if command_dict is not None:
+            self.command_dict = command_dict
+        return self.command_dict
     
     def add_task_to_table(self, task_widget: TaskItem, row):
         self.table_widget.insertRow(row)
@@ -758,11 +1033,14 @@ class Ui_TaskManager(QWidget):
         self.table_widget.setCellWidget(row, 4, task_widget.type_value)
         self.table_widget.setCellWidget(row, 5, task_widget.cpu_usage_progess)
         self.table_widget.setCellWidget(row, 6, task_widget.ram_usage_progess)
-        self.table_widget.setCellWidget(row, 7, task_widget.time_excute_value)
-        self.table_widget.setCellWidget(row, 8, task_widget.time_remain_value)
-        self.table_widget.setCellWidget(row, 9, task_widget.start_process_button)
-        self.table_widget.setCellWidget(row, 10, task_widget.kill_process_button) 
-        self.table_widget.setCellWidget(row, 11, task_widget.view_task_detail_button)
+        self.table_widget.setCellWidget(row, 7, task_widget.disk_io_value)
+        self.table_widget.setCellWidget(row, 8, task_widget.all_io_value)
+        self.table_widget.setCellWidget(row, 9, task_widget.handles_value)
+        self.table_widget.setCellWidget(row, 10, task_widget.time_excute_value)
+        self.table_widget.setCellWidget(row, 11, task_widget.time_remain_value)
+        self.table_widget.setCellWidget(row, 12, task_widget.start_process_button)
+        self.table_widget.setCellWidget(row, 13, task_widget.kill_process_button) 
+        self.table_widget.setCellWidget(row, 14, task_widget.view_task_detail_button)
         
     def adjust_column_widths(self):
         # Set the resize mode for specific columns to Fixed
@@ -778,7 +1056,18 @@ class Ui_TaskManager(QWidget):
         self.table_widget.setColumnWidth(4, 180)  # Adjusting RAM Usage column width
         self.table_widget.setColumnWidth(5, 200)  # Adjusting CPU Usage column width
         self.table_widget.setColumnWidth(6, 200)  # Adjusting RAM Usage column width
-        
+        self.table_widget.horizontalHeader().setSectionResizeMode(7, QHeaderView.Fixed)
+        self.table_widget.horizontalHeader().setSectionResizeMode(8, QHeaderView.Fixed)
+        self.table_widget.setColumnWidth(7, 220)  # Adjusting Disk I/O column width
+        self.table_widget.setColumnWidth(8, 220)  # Adjusting All I/O column width
+        
+    def update_db_pool_stats(self):
+        stats = self.db.get_pool_stats()
+        self.db_pool_value.setText(
+            f"In use: {stats['checked_out']}/{stats['size']} (+{stats['overflow']} overflow)\n"
+            f"Wait: {stats['avg_wait_ms']:.1f} ms avg, {stats['max_wait_ms']:.1f} ms max\n"
+            f"Invalidated: {stats['invalidations']} - Timeouts: {stats['timeouts']}")
+    
     def update_task_statictics(self):
         # print(task_widget.status)
         self.num_waiting_value.setText(str(sum(1 for task_widget in self.list_task_widget if (task_widget.status == StatusValue.WAITING and task_widget.onTable))))
@@ -797,11 +1086,14 @@ class Ui_TaskManager(QWidget):
             self.table_widget.setCellWidget(row, 4, item_widget.type_value)
             self.table_widget.setCellWidget(row, 5, item_widget.cpu_usage_progess)
             self.table_widget.setCellWidget(row, 6, item_widget.ram_usage_progess)
-            self.table_widget.setCellWidget(row, 7, item_widget.time_excute_value)
-            self.table_widget.setCellWidget(row, 8, item_widget.time_remain_value)
-            self.table_widget.setCellWidget(row, 9, item_widget.start_process_button)
-            self.table_widget.setCellWidget(row, 10, item_widget.kill_process_button)
-            self.table_widget.setCellWidget(row, 11, item_widget.view_task_detail_button)
+            self.table_widget.setCellWidget(row, 7, item_widget.disk_io_value)
+            self.table_widget.setCellWidget(row, 8, item_widget.all_io_value)
+            self.table_widget.setCellWidget(row, 9, item_widget.handles_value)
+            self.table_widget.setCellWidget(row, 10, item_widget.time_excute_value)
+            self.table_widget.setCellWidget(row, 11, item_widget.time_remain_value)
+            self.table_widget.setCellWidget(row, 12, item_widget.start_process_button)
+            self.table_widget.setCellWidget(row, 13, item_widget.kill_process_button)
+            self.table_widget.setCellWidget(row, 14, item_widget.view_task_detail_button)
 
         self.update_task_statictics()
 
@@ -817,6 +1109,9 @@ if __name__ == "__main__":
             return file.read()
 
     app = QApplication(sys.argv)
+    # asyncio event loop run by Qt, database queries are awaited without blocking the UI
+    loop = QEventLoop(app)
+    asyncio.set_event_loop(loop)
     stylesheet = load_stylesheet('stylesheet/SpyBot.qss')
     app.setStyleSheet(stylesheet)
 
@@ -836,4 +1131,5 @@ if __name__ == "__main__":
     # ui = TaskItem(avt_task)
     ui = Ui_TaskManager()
     ui.show()
-    sys.exit(app.exec_())
+    with loop:
+        sys.exit(loop.run_forever())
@@ -0,0 +1,116 @@
+import numpy as np
+import json
+import os
+
+# metrics sampled for each task process tree
+METRIC_FIELDS = ('cpu', 'ram', 'io', 'threads') # cpu in %, ram in MB, io in bytes/s (read + write), thread count
+
+class TaskMetrics:
+    # Fixed memory time series of the metrics of one task
+    # - last recent_capacity samples are kept as is in a ring buffer
+    # - older samples are rolled into buckets of bucket_size samples (min/max/avg of each field)
+    # - when the bucket buffer is full, adjacent buckets are merged two by two (bucket_size doubles),
+    #   so the whole task duration is kept at a lower resolution without growing memory
+    def __init__(self, recent_capacity=120, bucket_capacity=360, bucket_size=10):
+        field_count = len(METRIC_FIELDS)
+        self.recent = np.zeros((recent_capacity, 1 + field_count)) # time, fields
+        self.recent_start = 0 # index of the oldest sample
+        self.recent_count = 0
+        # bucket columns: start time, end time, sample count, then min, max, sum of each field
+        self.buckets = np.zeros((bucket_capacity, 3 + 3 * field_count))
+        self.bucket_count = 0
+        self.bucket_size = bucket_size # samples per bucket, doubles on each compaction
+        self.current_bucket = None # bucket being filled by samples leaving the recent buffer
+
+    def add_sample(self, sample_time, cpu, ram, io, threads):
+        capacity = len(self.recent)
+        if self.recent_count == capacity:
+            self.roll_to_bucket(self.recent[self.recent_start].copy())
+            self.recent_start = (self.recent_start + 1) % capacity
+            self.recent_count -= 1
+        self.recent[(self.recent_start + self.recent_count) % capacity] = (sample_time, cpu, ram, io, threads)
+        self.recent_count += 1
+
+    def get_recent(self, count=None):
+        # last count samples (all recent samples if None), oldest first, as array of rows (time, fields)
+        count = self.recent_count if count is None else min(count, self.recent_count)
+        indexes = (self.recent_start + self.recent_count - count + np.arange(count)) % len(self.recent)
+        return self.recent[indexes]
+
+    def roll_to_bucket(self, sample):
+        values = sample[1:]
+        if self.current_bucket is None:
+            self.current_bucket = np.concatenate(([sample[0], sample[0], 1], values, values, values))
+        else:
+            field_count = len(METRIC_FIELDS)
+            bucket = self.current_bucket
+            bucket[1] = sample[0]
+            bucket[2] += 1
+            bucket[3:3 + field_count] = np.minimum(bucket[3:3 + field_count], values)
+            bucket[3 + field_count:3 + 2 * field_count] = np.maximum(bucket[3 + field_count:3 + 2 * field_count], values)
+            bucket[3 + 2 * field_count:] += values
+
+        if self.current_bucket[2] >= self.bucket_size:
+            self.close_bucket()
+
+    def close_bucket(self):
+        if self.current_bucket is None:
+            return
+        if self.bucket_count == len(self.buckets):
+            self.compact_buckets()
+        self.buckets[self.bucket_count] = self.current_bucket
+        self.bucket_count += 1
+        self.current_bucket = None
+
+    def compact_buckets(self):
+        # merge buckets two by two, free half of the bucket buffer
+        field_count = len(METRIC_FIELDS)
+        count = self.bucket_count - self.bucket_count % 2
+        first = self.buckets[0:count:2]
+        second = self.buckets[1:count:2]
+        merged = first.copy()
+        merged[:, 1] = second[:, 1]
+        merged[:, 2] = first[:, 2] + second[:, 2]
+        merged[:, 3:3 + field_count] = np.minimum(first[:, 3:3 + field_count], second[:, 3:3 + field_count])
+        merged[:, 3 + field_count:3 + 2 * field_count] = np.maximum(first[:, 3 + field_count:3 + 2 * field_count],
+                                                                    second[:, 3 + field_count:3 + 2 * field_count])
+        merged[:, 3 + 2 * field_count:] = first[:, 3 + 2 * field_count:] + second[:, 3 + 2 * field_count:]
+
+        merged_count = len(merged)
+        if self.bucket_count % 2: # odd bucket left alone
+            self.buckets[merged_count] = self.buckets[self.bucket_count - 1]
+        self.buckets[:merged_count] = merged
+        self.bucket_count = merged_count + self.bucket_count % 2
+        self.bucket_size *= 2
+
+    def to_dict(self):
+        # full profile: downsampled buckets of old samples then recent samples
+        field_count = len(METRIC_FIELDS)
+        buckets = self.buckets[:self.bucket_count]
+        if self.current_bucket is not None:
+            buckets = np.vstack((buckets, self.current_bucket))
+        return {
+            'fields': list(METRIC_FIELDS),
+            'buckets': [{
+                'start': float(bucket[0]),
+                'end': float(bucket[1]),
+                'samples': int(bucket[2]),
+                'min': bucket[3:3 + field_count].tolist(),
+                'max': bucket[3 + field_count:3 + 2 * field_count].tolist(),
+                'avg': (bucket[3 + 2 * field_count:] / bucket[2]).tolist()
+            } for bucket in buckets],
+            'recent': self.get_recent().tolist() # [time, fields...]
+        }
+
+    def save_to_json(self, file_path, extra=None):
+        # extra: more data of the task saved with the profile, ex: {'rusage': {...}}
+        try:
+            file_dir = os.path.dirname(file_path)
+            if file_dir != "":
+                os.makedirs(file_dir, exist_ok=True)
+            with open(file_path, 'w') as json_file:
+                json.dump({**self.to_dict(), **(extra or {})}, json_file)
+            return True
+        except OSError as e:
+            print(f"Error saving task metrics to {file_path}: {e}")
+            return False
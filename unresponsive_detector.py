@@ -0,0 +1,98 @@
+import time
+
+# activity signals of a task process tree
+# cpu: cpu time, io: disk and syscall (network, pipe) read + write bytes, ctx_switches: voluntary context switches (wake up from sleep/IO wait),
+# log: process log file size, heartbeat: task data (task_stat/updated_at) updated by the module in database
+ACTIVITY_SIGNALS = ('cpu', 'io', 'ctx_switches', 'log', 'heartbeat')
+# signals showing the task moves forward, a process using cpu without any of them is busy looping
+PROGRESS_SIGNALS = ('io', 'log', 'heartbeat')
+
+class UnresponsiveConfig:
+    # Thresholds of the unresponsive detector, configurable per task type in config.json section "unresponsive":
+    # {"default": {...}, "<task_type>": {...}}, values of the task type override default values
+    def __init__(self, enabled=True, idle_timeout=120, busy_timeout=600, heartbeat_timeout=None,
+                 min_cpu_time=0.01, min_io_bytes=1, min_ctx_switches=1, min_log_growth=1):
+        self.enabled = enabled
+        self.idle_timeout = idle_timeout # in seconds, no activity at all (deadlock, stalled connection)
+        self.busy_timeout = busy_timeout # in seconds, cpu used without progress (busy loop), None: disabled
+        self.heartbeat_timeout = heartbeat_timeout # in seconds, no heartbeat whatever other activity, None: disabled
+        # minimum change between two samples counted as activity
+        self.min_cpu_time = min_cpu_time # in seconds of cpu time
+        self.min_io_bytes = min_io_bytes
+        self.min_ctx_switches = min_ctx_switches
+        self.min_log_growth = min_log_growth # in bytes
+
+    @classmethod
+    def from_dict(cls, section, task_type=None):
+        values = dict((section or {}).get('default', {}))
+        if task_type is not None:
+            values.update((section or {}).get(str(task_type), {}))
+        return cls(**values)
+
+class UnresponsiveDetector:
+    # Decide if a task is hung from several activity signals, O(1) per sample:
+    # only the last value and the last activity time of each signal are kept (rolling window = timeout)
+    # - idle: no signal active for idle_timeout
+    # - busy loop: cpu active on every sample for busy_timeout, without io, log or heartbeat progress
+    # - no heartbeat: module did not update its task for heartbeat_timeout (opt-in)
+    def __init__(self, config: UnresponsiveConfig = None):
+        self.config = config if config is not None else UnresponsiveConfig()
+        self.thresholds = {
+            'cpu': self.config.min_cpu_time,
+            'io': self.config.min_io_bytes,
+            'ctx_switches': self.config.min_ctx_switches,
+            'log': self.config.min_log_growth
+        }
+        self.reset()
+
+    def reset(self, now=None):
+        # process (re)started, every signal counts as active now
+        now = time.monotonic() if now is None else now
+        self.last_values = None
+        self.last_active = {signal: now for signal in ACTIVITY_SIGNALS}
+        self.cpu_busy_since = None # start of the current run of samples with cpu activity
+        self.unresponsive = False
+        self.reason = ""
+
+    def record_heartbeat(self, now=None):
+        self.last_active['heartbeat'] = time.monotonic() if now is None else now
+
+    def add_sample(self, values, now=None):
+        # values: {'cpu': cpu time, 'io': bytes, 'ctx_switches': count, 'log': bytes}, cumulative counters
+        # return the verdict, True if the task is unresponsive (reason in self.reason)
+        now = time.monotonic() if now is None else now
+        if self.last_values is not None:
+            for signal, threshold in self.thresholds.items():
+                # counters of the tree can also drop (child exit, log rotation), any change is activity
+                if abs(values[signal] - self.last_values[signal]) >= threshold:
+                    self.last_active[signal] = now
+            if self.last_active['cpu'] == now:
+                if self.cpu_busy_since is None:
+                    self.cpu_busy_since = now
+            else:
+                self.cpu_busy_since = None
+        self.last_values = values
+
+        self.unresponsive, self.reason = self.evaluate(now)
+        return self.unresponsive
+
+    def evaluate(self, now):
+        config = self.config
+        if not config.enabled:
+            return False, ""
+
+        idle_time = now - max(self.last_active.values())
+        if idle_time > config.idle_timeout:
+            return True, f"No cpu, io, context switch, log or heartbeat activity for {idle_time:.0f}s"
+
+        if config.busy_timeout is not None and self.cpu_busy_since is not None:
+            no_progress_time = now - max(self.last_active[signal] for signal in PROGRESS_SIGNALS)
+            if now - self.cpu_busy_since > config.busy_timeout and no_progress_time > config.busy_timeout:
+                return True, f"Busy loop, cpu used without io, log or heartbeat progress for {no_progress_time:.0f}s"
+
+        if config.heartbeat_timeout is not None:
+            heartbeat_age = now - self.last_active['heartbeat']
+            if heartbeat_age > config.heartbeat_timeout:
+                return True, f"No heartbeat (task update) for {heartbeat_age:.0f}s"
+
+        return False, ""